@@ -1,5 +1,10 @@
+import os
+import logging
 from flask_app import init_app
 
+log_level = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(format="%(asctime)s %(levelname)s:   %(message)s", level=log_level)
+
 app = init_app()
 
 # Start the server
@@ -18,6 +18,22 @@ ENDPOINT = (
 # https://docs.microsoft.com/en-us/graph/permissions-reference
 SCOPE = ["User.Read"]
 
-SESSION_TYPE = (
-    "filesystem"  # Specifies the token cache should be stored in server-side session
-)
+# HTTP client used by msal to reach the authority, a requests.Session when None.
+# load_test.py sets one which sends the calls to its local stand-in authority
+MSAL_HTTP_CLIENT = None
+
+# Specifies the token cache should be stored in server-side session.
+# "sqlite" uses session_store.CachedSessionInterface (in-process LRU in front of a
+# SQLite database in WAL mode shared by all workers), other values go to flask-session
+SESSION_TYPE = os.environ.get("SESSION_TYPE", "sqlite")
+SESSION_SQLITE_PATH = os.environ.get("SESSION_SQLITE_PATH", "flask_session/sessions.db")
+SESSION_LRU_SIZE = 1024
+# Seconds between two bulk deletions of expired sessions
+SESSION_CLEANUP_INTERVAL = 300
+
+# Load the default dataset in a background thread at startup instead of on first dashboard use
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# Watch the dataset files for appended rows (datasets.refresh_interval in config.yaml)
+# in a background thread, serve.py starts the watcher in each worker instead
+DATA_WATCH = os.environ.get("DATA_WATCH", "true").lower() in ("1", "true", "yes")
@@ -2,11 +2,33 @@
 compute_recurrences.py
 =============================
 main module/script of python-example
+
+Without arguments it runs the demo. The batch subcommand evaluates recurrence
+definitions read as JSON lines on a pool of processes, one result line per definition:
+    python src/compute_recurrences.py batch definitions.jsonl > results.jsonl
+
+A definition is e.g.
+    {"id": "fib", "offsets": [-1, -2], "coefficients": [1, 1], "seed": [1, 1],
+     "indices": [10, 20], "range": [0, 5]}
+where "range" takes the arguments of python's range, and an optional "modulus" computes
+the values modulo it, for indices as large as wanted. This gives
+    {"id": "fib", "line": 1, "indices": [10, 20, 0, 1, 2, 3, 4],
+     "values": [89, 10946, 1, 1, 2, 3, 5]}
+or an "error" instead of the indices and values if the definition is invalid, asks for
+more than --max-values values, or would compute more than --max-index values (the largest
+index without a modulus, the values before they repeat with one).
 """
 
 import os
+import sys
 import math
+import json
+import argparse
 import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Iterator, List, TextIO
 from recurrence_calculators import FibonacciCalculator, RecurrenceCalculator
 
 # This is one way to explicitly set the log level in code
@@ -14,6 +36,11 @@ log_level = os.environ.get("LOGLEVEL", "INFO").upper()
 logging.basicConfig(format="%(asctime)s %(levelname)s:   %(message)s", level=log_level)
 logger = logging.getLogger()
 
+# Default limits of a batch definition, which bound the memory and time of a worker
+# and the size of a result line
+MAX_INDEX = 50000
+MAX_VALUES = 10000
+
 
 def ratio(calc: RecurrenceCalculator, index: int) -> float:
     """
@@ -32,7 +59,226 @@ def ratio(calc: RecurrenceCalculator, index: int) -> float:
     return round(calc.compute(index + 1) / calc.compute(index), 5)
 
 
-if __name__ == "__main__":
+def build_calculator(definition: Dict) -> RecurrenceCalculator:
+    """
+    Create the calculator of a batch definition
+
+    Parameters
+    ----------
+    definition
+        recurrence definition with "offsets", "coefficients" and "seed" lists, and an
+        optional "modulus"
+
+    Returns
+    -------
+    RecurrenceCalculator
+        calculator of the recurrence
+    """
+    offsets = definition["offsets"]
+    coefficients = definition["coefficients"]
+    seed = definition["seed"]
+    if len(offsets) != len(coefficients):
+        raise ValueError("mismatching offsets and coefficients lengths")
+    if not all(isinstance(offset, int) and offset < 0 for offset in offsets):
+        raise ValueError("offsets must be negative integers")
+    if len(seed) < -min(offsets, default=0):
+        raise ValueError("seed needs at least %d values" % -min(offsets))
+    return RecurrenceCalculator(
+        offsets, coefficients, seed, modulus=definition.get("modulus")
+    )
+
+
+def requested_indices(definition: Dict, max_values: int = MAX_VALUES) -> List[int]:
+    """
+    List the indices requested by a batch definition
+
+    Parameters
+    ----------
+    definition
+        recurrence definition with "indices" and/or "range"
+    max_values
+        maximum number of indices
+
+    Returns
+    -------
+    List[int]
+        the "indices" followed by the indices of the "range"
+    """
+    indices = list(definition.get("indices", []))
+    spread = range(*definition["range"]) if "range" in definition else range(0)
+    # The length of a range is known without listing it
+    if len(indices) + len(spread) > max_values:
+        raise ValueError("more than %d values requested" % max_values)
+    indices.extend(spread)
+    if not all(isinstance(index, int) and index >= 0 for index in indices):
+        raise ValueError("indices must be non negative integers")
+    return indices
+
+
+def evaluate(
+    definition: Dict, max_index: int = MAX_INDEX, max_values: int = MAX_VALUES
+) -> Dict:
+    """
+    Compute the requested values of a batch definition, this runs in the pool processes
+
+    Parameters
+    ----------
+    definition
+        recurrence definition
+    max_index
+        maximum number of values computed: the largest index without a modulus, the
+        values computed before they repeat with one
+    max_values
+        maximum number of values requested
+
+    Returns
+    -------
+    Dict
+        result record with the "id" of the definition and either its "indices" and
+        "values" or an "error"
+    """
+    record = {"id": definition.get("id")}
+    try:
+        calc = build_calculator(definition)
+        indices = requested_indices(definition, max_values)
+        largest = max(indices, default=-1)
+        # Fill the memo from the start so compute never recurses deeper than the offsets,
+        # residues are computed in order anyway and reduced by the period for large indices
+        if calc.modulus is None:
+            if largest > max_index:
+                raise ValueError("indices above %d need a modulus" % max_index)
+            for index in range(largest + 1):
+                calc.compute(index)
+        else:
+            while calc.period is None and calc.count() <= largest:
+                if calc.count() > max_index:
+                    raise ValueError("values do not repeat within %d" % max_index)
+                calc.append_residue()
+                calc.detect_cycle()
+        record.update(indices=indices, values=[calc.compute(i) for i in indices])
+    except Exception as e:
+        record["error"] = "%s: %s" % (type(e).__name__, e)
+    return record
+
+
+def run_batch(
+    lines: Iterable[str],
+    workers: int,
+    window: int,
+    ordered: bool = True,
+    max_index: int = MAX_INDEX,
+    max_values: int = MAX_VALUES,
+) -> Iterator[Dict]:
+    """
+    Evaluate definitions on a pool of processes, with at most window of them in flight
+    so that memory stays bounded however many lines are read. If a process dies (e.g.
+    killed when out of memory) its definitions get an error and a new pool is started.
+
+    Parameters
+    ----------
+    lines
+        JSON recurrence definitions, one per line, blank lines are skipped
+    workers
+        number of processes
+    window
+        maximum number of definitions submitted and not yet yielded
+    ordered
+        yield the results in input order, otherwise as soon as they are completed
+    max_index
+        maximum number of values computed per definition, see evaluate
+    max_values
+        maximum number of values requested per definition
+
+    Returns
+    -------
+    Iterator[Dict]
+        result records with the line number of their definition
+    """
+    pending = deque()
+    pool = ProcessPoolExecutor(workers)
+    try:
+
+        def submit(line_number: int, line: str) -> Future:
+            nonlocal pool
+            try:
+                definition = json.loads(line)
+                if not isinstance(definition, dict):
+                    raise ValueError("a definition must be a JSON object")
+            except ValueError as e:
+                future = Future()
+                future.set_result({"id": None, "error": "ValueError: %s" % e})
+            else:
+                try:
+                    future = pool.submit(evaluate, definition, max_index, max_values)
+                except BrokenProcessPool:
+                    logger.warning("A worker process died, starting a new pool")
+                    pool.shutdown(wait=False)
+                    pool = ProcessPoolExecutor(workers)
+                    future = pool.submit(evaluate, definition, max_index, max_values)
+                future.id = definition.get("id")
+            future.line = line_number
+            return future
+
+        def collect(future: Future) -> Dict:
+            try:
+                record = dict(future.result())
+            except BrokenProcessPool as e:
+                record = {"id": future.id, "error": "BrokenProcessPool: %s" % e}
+            return {"id": record.pop("id"), "line": future.line, **record}
+
+        def next_results() -> Iterator[Dict]:
+            if ordered:
+                yield collect(pending.popleft())
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield collect(future)
+
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            pending.append(submit(line_number, line))
+            while len(pending) >= window:
+                yield from next_results()
+        while pending:
+            yield from next_results()
+    finally:
+        pool.shutdown()
+
+
+def write_records(records: Iterable[Dict], output: TextIO) -> int:
+    """
+    Stream result records as JSON lines
+
+    Parameters
+    ----------
+    records
+        result records
+    output
+        file the lines are written to, flushed after each line
+
+    Returns
+    -------
+    int
+        number of records with an error
+    """
+    errors = 0
+    for record in records:
+        errors += "error" in record
+        output.write(json.dumps(record) + "\n")
+        output.flush()
+    return errors
+
+
+def demo() -> None:
+    """
+    Log a few Fibonacci numbers, their ratios and the values of another recurrence
+
+    Returns
+    -------
+    None
+    """
     N = 50
 
     # r[n] = r[n-1] + r[n-2], r[0] = 1, r[1] = 1
@@ -59,3 +305,78 @@ if __name__ == "__main__":
 
     # This line will throw a warning level log message because the parameters do not match in length
     # rec_calc_warn = RecurrenceCalculator([-1, -3, -4], [1, -2], [1, 1, 1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compute recurrences, runs the demo without a command"
+    )
+    commands = parser.add_subparsers(dest="command")
+    batch = commands.add_parser(
+        "batch", help="evaluate JSON lines recurrence definitions in parallel"
+    )
+    batch.add_argument(
+        "input", nargs="?", default="-", help="definitions file (default: stdin)"
+    )
+    batch.add_argument(
+        "-o", "--output", default="-", help="results file (default: stdout)"
+    )
+    batch.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of processes (default: number of cores)",
+    )
+    batch.add_argument(
+        "--window",
+        type=int,
+        default=None,
+        help="maximum definitions in flight (default: 4 per process)",
+    )
+    batch.add_argument(
+        "--max-index",
+        type=int,
+        default=MAX_INDEX,
+        help="maximum values computed per definition: largest index without a "
+        "modulus, values before they repeat with one (default: %(default)s)",
+    )
+    batch.add_argument(
+        "--max-values",
+        type=int,
+        default=MAX_VALUES,
+        help="maximum values requested per definition (default: %(default)s)",
+    )
+    batch.add_argument(
+        "--unordered",
+        action="store_true",
+        help="write the results as they complete instead of in input order",
+    )
+    args = parser.parse_args()
+
+    if args.command != "batch":
+        demo()
+        sys.exit(0)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.window is not None and args.window < 1:
+        parser.error("--window must be at least 1")
+    if args.max_index < 0 or args.max_values < 0:
+        parser.error("--max-index and --max-values must not be negative")
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    with source, output:
+        failed = write_records(
+            run_batch(
+                source,
+                args.workers,
+                args.window or 4 * args.workers,
+                ordered=not args.unordered,
+                max_index=args.max_index,
+                max_values=args.max_values,
+            ),
+            output,
+        )
+    if failed:
+        logger.warning("%d definitions failed", failed)
+    sys.exit(1 if failed else 0)
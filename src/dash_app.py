@@ -6,15 +6,110 @@
 # Note that the styling for the various panels is defined in assets/style.css
 # which is automatically loaded by dash.
 
+import threading
+import weakref
+from typing import Dict, Optional
 from model import Model
+from dataset_registry import DatasetRegistry
+from response_cache import CallbackResponseCache
+from utils import get_config
 
 # Dash imports
-from dash import Input, Output, dcc, html, Dash, dash_table
+from dash import Input, Output, State, dcc, html, Dash, dash_table
+from dash.exceptions import PreventUpdate
 import plotly.graph_objs as go
 from azure_ad import app_config
 
-# Initialize the model and prepare the data
-model = Model("data/housing.csv")
+try:
+    # Plotly imports its fast JSON encoder on first use, which concurrent first
+    # requests can see half initialized, so import it up front when installed
+    import orjson  # noqa: F401
+except ImportError:
+    pass
+
+# Models are built lazily per dataset, either on first dashboard use or by the warm-up
+# thread, so that importing this module (and serving routes like /login) stays fast
+registry = DatasetRegistry.from_config(get_config())
+
+# Per-cell stats which can be shown on the map, as labelled in the map controls
+MAP_METRICS = {
+    "value": "Mean house value",
+    "count": "Number of houses",
+    "residual": "Mean residual of your fitted model",
+}
+
+# Tab layouts are built once per data version of each dataset, and the serialized
+# callback responses are cached so repeated tab switches do not rebuild
+# or re-serialize them. Layouts are dropped along with the model when it is evicted.
+_tab_layouts = weakref.WeakKeyDictionary()
+
+
+def get_model(dataset_id: Optional[str] = None) -> Model:
+    """
+    Return the model of a dataset, loading and preparing the data on first use
+
+    Parameters
+    ----------
+    dataset_id
+        id of the dataset selected in the dashboard, the default dataset if None
+
+    Returns
+    ------
+    Model
+        the initialized model shared by all callbacks
+
+    Raises
+    ------
+    PreventUpdate
+        if the id, which is sent by the client, is not a configured dataset
+    """
+    if dataset_id and dataset_id not in registry.ids():
+        raise PreventUpdate
+    return registry.get(dataset_id)
+
+
+def warm_up_model() -> threading.Thread:
+    """
+    Start building the model of the default dataset in a background daemon thread
+
+    Returns
+    ------
+    threading.Thread
+        the started warm-up thread
+    """
+    thread = threading.Thread(target=get_model, name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def tab_cache_key(body: Dict):
+    """
+    Cache key of a tab callback request: the tab, the dataset and its data version
+
+    Parameters
+    ----------
+    body
+        JSON body of the callback request
+
+    Returns
+    ------
+    Tuple[str, str, int]
+        key identifying the rendered tab content, None for an unknown dataset so the
+        request is passed to the callback (which ignores it) without being cached
+    """
+    inputs = {item["id"]: item.get("value") for item in body.get("inputs", [])}
+    dataset_id = inputs.get("dataset") or registry.default
+    if dataset_id not in registry.ids():
+        return None
+    return (
+        inputs.get("tabs-controller"),
+        dataset_id,
+        get_model(dataset_id).data_version,
+    )
+
+
+tab_response_cache = CallbackResponseCache("tabs-content.children", tab_cache_key)
+
 
 # Create the app
 def init_dash_app(server):
@@ -27,6 +122,19 @@ def init_dash_app(server):
 
     app.layout = html.Div(
         [
+            # Selector of the dataset used by all the tabs
+            html.Div(
+                [
+                    html.Label("Dataset:", style={"fontWeight": "bold"}),
+                    dcc.Dropdown(
+                        id="dataset",
+                        options=[{"label": x, "value": x} for x in registry.ids()],
+                        value=registry.default,
+                        clearable=False,
+                    ),
+                ],
+                id="dataset_panel",
+            ),
             dcc.Tabs(
                 id="tabs-controller",
                 value="data_table",
@@ -49,20 +157,206 @@ def init_dash_app(server):
                         className="custom-tab",
                         selected_className="custom-tab--selected",
                     ),
+                    dcc.Tab(
+                        label="Map",
+                        value="map",
+                        className="custom-tab",
+                        selected_className="custom-tab--selected",
+                    ),
                 ],
             ),
             html.Div(id="tabs-content"),
+            # Algorithm and features of the model this user fitted last, the map
+            # shows its residuals (the model controls only exist in their tab)
+            dcc.Store(id="fitted_model"),
         ]
     )
     init_callbacks(app)
+    app = tab_response_cache.install(app)
+    if app_config.MODEL_WARMUP:
+        warm_up_model()
+    if app_config.DATA_WATCH:
+        registry.start_watcher()
     return app
 
 
+def build_tab_content(model: Model, tab: str):
+    """
+    Build the component tree of a tab from the current model data
+
+    Parameters
+    ----------
+    model
+        model providing the data, summary, algorithms and features to display
+    tab
+        value of the tab to build
+
+    Returns
+    ------
+    html
+        structured dash component objects which get rendered to frontend layout code
+    """
+    if tab == "data_table":
+        return html.Div(
+            [
+                # Banner along top
+                html.H1("Housing Price Data", id="banner"),
+                dash_table.DataTable(
+                    id="table",
+                    columns=[{"name": i, "id": i} for i in model.head(0).columns],
+                    style_table={
+                        "overflowX": "auto",
+                        "minWidth": "100%",
+                        "width": "100%",
+                        "maxWidth": "100%",
+                    },
+                    style_cell={
+                        "overflow": "hidden",
+                        "textOverflow": "ellipsis",
+                        "minWidth": "80px",
+                        "width": "80px",
+                        "maxWidth": "80px",
+                        "textAlign": "center",
+                    },
+                    data=model.head(20).to_dict("records"),
+                ),
+            ]
+        )
+    elif tab == "data_summary":
+        trace1 = go.Bar(
+            x=["< 1H OCEAN", "INLAND", "NEAR BAY", "NEAR OCEAN"],
+            y=model.summary["young"],
+            name="Houses 15yrs or newer",
+            marker_color="rgb(239,179,171)",
+        )
+        trace2 = go.Bar(
+            x=["< 1H OCEAN", "INLAND", "NEAR BAY", "NEAR OCEAN"],
+            y=model.summary["medium"],
+            name="Houses 15-30yrs old",
+            marker_color="rgb(207, 81, 61)",
+        )
+        trace3 = go.Bar(
+            x=["< 1H OCEAN", "INLAND", "NEAR BAY", "NEAR OCEAN"],
+            y=model.summary["old"],
+            name="Houses older than 30yrs",
+            marker_color="rgb(147, 59, 39)",
+        )
+        return html.Div(
+            [
+                dcc.Graph(
+                    id="bar_plot",
+                    figure=go.Figure(
+                        data=[trace1, trace2, trace3],
+                        layout=go.Layout(barmode="stack"),
+                    ),
+                )
+            ]
+        )
+    elif tab == "show_model":
+        return html.Div(
+            [
+                # Banner along top
+                html.H1("Housing Price Model", id="banner"),
+                # Right panel: x/y graph
+                html.Div(
+                    [html.H2("Model Graph"), dcc.Graph(id="scatter")],
+                    id="output_panel",
+                ),  # id of the panel is used by stylesheet
+                # Left panel: model controls
+                html.Div(
+                    [
+                        # Heading at top of panel
+                        html.H2("Control Panel"),
+                        # Drop-down list of algorithms
+                        html.Label("Algorithm:", style={"fontWeight": "bold"}),
+                        dcc.Dropdown(
+                            id="algorithm",
+                            options=[{"label": x, "value": x} for x in model.algos],
+                            value=model.algos[0],
+                        ),
+                        # Checkboxes of features to include (by default all are on)
+                        html.Label(
+                            "Features to use:",
+                            style={
+                                "fontWeight": "bold",
+                                "display": "block",
+                                "marginTop": "20px",
+                            },
+                        ),
+                        dcc.Checklist(
+                            id="features",
+                            options=[
+                                {"label": x, "value": x} for x in model.features_list
+                            ],
+                            value=model.features_list,
+                            labelStyle={"display": "block"},
+                        ),
+                    ],
+                    # Id of the panel is used by stylesheet for layout
+                    id="control_panel",
+                ),
+            ]
+        )
+    elif tab == "map":
+        return html.Div(
+            [
+                html.H1("Housing Price Map", id="banner"),
+                html.Div(
+                    [html.H2("Map"), dcc.Graph(id="map", style={"height": "70vh"})],
+                    id="output_panel",
+                ),
+                html.Div(
+                    [
+                        html.H2("Control Panel"),
+                        html.Label("Color cells by:", style={"fontWeight": "bold"}),
+                        dcc.RadioItems(
+                            id="map_metric",
+                            options=[
+                                {"label": label, "value": value}
+                                for value, label in MAP_METRICS.items()
+                            ],
+                            value="value",
+                            labelStyle={"display": "block"},
+                        ),
+                    ],
+                    id="control_panel",
+                ),
+            ]
+        )
+
+
+def viewport(relayout: Optional[Dict]):
+    """
+    Extract the visible longitude and latitude ranges from the relayout data of a graph
+
+    Parameters
+    ----------
+    relayout
+        relayoutData of the graph, set by plotly when the user pans or zooms
+
+    Returns
+    ------
+    Tuple[Optional[Tuple[float, float]], Optional[Tuple[float, float]]]
+        longitude and latitude ranges, None when the axis shows everything
+    """
+    relayout = relayout or {}
+    ranges = []
+    for axis in ["xaxis", "yaxis"]:
+        if axis + ".range[0]" in relayout:
+            ranges.append((relayout[axis + ".range[0]"], relayout[axis + ".range[1]"]))
+        elif axis + ".range" in relayout:
+            ranges.append(tuple(relayout[axis + ".range"]))
+        else:
+            ranges.append(None)
+    return tuple(ranges)
+
+
 def init_callbacks(app):
     @app.callback(
-        Output("tabs-content", "children"), [Input("tabs-controller", "value")]
+        Output("tabs-content", "children"),
+        [Input("tabs-controller", "value"), Input("dataset", "value")],
     )
-    def render_tab_content(tab):
+    def render_tab_content(tab, dataset_id):
         """
         Handler to update tab display when a different tab is clicked
 
@@ -70,128 +364,39 @@ def init_callbacks(app):
         ----------
         tab
             input value which tracks which tab is clicked and showing
+        dataset_id
+            input value of the selected dataset
 
         Returns
         ------
         html
             structured dash component objects which get rendered to frontend layout code
         """
-        if tab == "data_table":
-            return html.Div(
-                [
-                    # Banner along top
-                    html.H1("Housing Price Data", id="banner"),
-                    dash_table.DataTable(
-                        id="table",
-                        columns=[{"name": i, "id": i} for i in model.data.columns],
-                        style_table={
-                            "overflowX": "auto",
-                            "minWidth": "100%",
-                            "width": "100%",
-                            "maxWidth": "100%",
-                        },
-                        style_cell={
-                            "overflow": "hidden",
-                            "textOverflow": "ellipsis",
-                            "minWidth": "80px",
-                            "width": "80px",
-                            "maxWidth": "80px",
-                            "textAlign": "center",
-                        },
-                        data=model.data[:20].to_dict("records"),
-                    ),
-                ]
-            )
-        elif tab == "data_summary":
-            trace1 = go.Bar(
-                x=["< 1H OCEAN", "INLAND", "NEAR BAY", "NEAR OCEAN"],
-                y=model.summary["young"],
-                name="Houses 15yrs or newer",
-                marker_color="rgb(239,179,171)",
-            )
-            trace2 = go.Bar(
-                x=["< 1H OCEAN", "INLAND", "NEAR BAY", "NEAR OCEAN"],
-                y=model.summary["medium"],
-                name="Houses 15-30yrs old",
-                marker_color="rgb(207, 81, 61)",
-            )
-            trace3 = go.Bar(
-                x=["< 1H OCEAN", "INLAND", "NEAR BAY", "NEAR OCEAN"],
-                y=model.summary["old"],
-                name="Houses older than 30yrs",
-                marker_color="rgb(147, 59, 39)",
-            )
-            return html.Div(
-                [
-                    dcc.Graph(
-                        id="bar_plot",
-                        figure=go.Figure(
-                            data=[trace1, trace2, trace3],
-                            layout=go.Layout(barmode="stack"),
-                        ),
-                    )
-                ]
-            )
-        elif tab == "show_model":
-            return html.Div(
-                [
-                    # Banner along top
-                    html.H1("Housing Price Model", id="banner"),
-                    # Right panel: x/y graph
-                    html.Div(
-                        [html.H2("Model Graph"), dcc.Graph(id="scatter")],
-                        id="output_panel",
-                    ),  # id of the panel is used by stylesheet
-                    # Left panel: model controls
-                    html.Div(
-                        [
-                            # Heading at top of panel
-                            html.H2("Control Panel"),
-                            # Drop-down list of algorithms
-                            html.Label("Algorithm:", style={"fontWeight": "bold"}),
-                            dcc.Dropdown(
-                                id="algorithm",
-                                options=[{"label": x, "value": x} for x in model.algos],
-                                value=model.algos[0],
-                            ),
-                            # Checkboxes of features to include (by default all are on)
-                            html.Label(
-                                "Features to use:",
-                                style={
-                                    "fontWeight": "bold",
-                                    "display": "block",
-                                    "marginTop": "20px",
-                                },
-                            ),
-                            dcc.Checklist(
-                                id="features",
-                                options=[
-                                    {"label": x, "value": x}
-                                    for x in model.features_list
-                                ],
-                                value=model.features_list,
-                                labelStyle={"display": "block"},
-                            ),
-                        ],
-                        # Id of the panel is used by stylesheet for layout
-                        id="control_panel",
-                    ),
-                ]
-            )
+        model = get_model(dataset_id)
+        layouts = _tab_layouts.setdefault(model, {})
+        version, layout = layouts.get(tab, (None, None))
+        if version != model.data_version:
+            version, layout = model.data_version, build_tab_content(model, tab)
+            layouts[tab] = (version, layout)
+        return layout
 
     # Callback handler, which updates the graph when the user chooses an algorithm
     # or selects/deselects features. When this happens, rerun the model and update
     # scatter plot of actual vs. predicted prices.
     @app.callback(
-        Output("scatter", "figure"),  # The component that gets updated (only one)
+        [
+            Output("scatter", "figure"),  # The components that get updated
+            Output("fitted_model", "data"),
+        ],
         [
             Input(
                 "algorithm", "value"
             ),  # The input component(s) that trigger the update
             Input("features", "value"),
         ],
+        [State("dataset", "value")],
     )  # (any change from these trigger function re-eval)
-    def update_model(algorithm, features):  # Arguments correspond to the Inputs
+    def update_model(algorithm, features, dataset_id):  # Arguments match Inputs+State
         """
         Handler refits a model when algorithm/features are changed.
         Produces predictions and accuracy on training data which plotly can display
@@ -202,13 +407,18 @@ def init_callbacks(app):
             input value which selects which algorithm to use in fitting
         features:
             input value which is a list of checked features to use in fitting
+        dataset_id
+            state value of the selected dataset
 
         Returns
         ------
-        dict
-            data structured for a plotly chart along with display properties
+        Tuple[dict, dict]
+            data structured for a plotly chart along with display properties, and the
+            algorithm and features of the fitted model
         """
-        housevals, predictions, r2 = model.fit_model(algorithm, features)
+        housevals, predictions, r2 = get_model(dataset_id).fit_model(
+            algorithm, features
+        )
         print("*** %s with %d features: R2 = %.4f" % (algorithm, len(features), r2))
 
         # Return a dictionary that defines the graph of actual vs. predicted
@@ -222,4 +432,65 @@ def init_callbacks(app):
                 {"text": "R-squared = %.4f" % r2, "showarrow": False, "y": "top"}
             ],
         }
-        return {"data": gdata, "layout": layout}
+        fitted = {"algorithm": algorithm, "features": features}
+        return {"data": gdata, "layout": layout}, fitted
+
+    # Callback handler, which redraws the map when the user pans or zooms or changes
+    # the metric. Only the cells visible in the viewport are sent, aggregated at a
+    # level of the grid index matching the zoom.
+    @app.callback(
+        Output("map", "figure"),
+        [Input("map_metric", "value"), Input("map", "relayoutData")],
+        [State("dataset", "value"), State("fitted_model", "data")],
+    )
+    def update_map(metric, relayout, dataset_id, fitted):
+        """
+        Handler queries the grid index for the cells visible in the map viewport
+
+        Parameters
+        ----------
+        metric
+            input value which selects which per-cell stat is shown
+        relayout
+            input value with the axis ranges after the user panned or zoomed
+        dataset_id
+            state value of the selected dataset
+        fitted
+            state value with the algorithm and features of the user's fitted model
+
+        Returns
+        ------
+        go.Figure
+            heatmap of the visible cells
+        """
+        model = get_model(dataset_id)
+        grid = model.spatial_index()
+        if grid is None:
+            return go.Figure(layout={"title": "This dataset has no locations"})
+
+        fitted = fitted or {}
+        residual_sum = model.residual_sum(
+            fitted.get("algorithm"), fitted.get("features")
+        )
+        x_range, y_range = viewport(relayout)
+        cells = grid.query(x_range, y_range, residual_sum=residual_sum)
+        heatmap = go.Heatmap(
+            x=cells["x"],
+            y=cells["y"],
+            z=cells[metric],
+            colorscale="RdBu" if metric == "residual" else "Reds",
+            zmid=0 if metric == "residual" else None,
+            hoverongaps=False,
+            colorbar={"title": MAP_METRICS[metric]},
+        )
+        title = MAP_METRICS[metric]
+        if metric == "residual" and residual_sum is None:
+            title += " (fit a model in the Model Evaluation tab first)"
+        layout = go.Layout(
+            title=title,
+            xaxis={"title": "Longitude"},
+            yaxis={"title": "Latitude", "scaleanchor": "x"},
+            # Keep the user's zoom when the figure is replaced
+            uirevision=dataset_id,
+        )
+        return go.Figure(data=[heatmap], layout=layout)
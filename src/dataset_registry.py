@@ -0,0 +1,262 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import Callable, Dict, List, Optional
+from model import Model
+
+
+class DatasetRegistry:
+    """Loads one Model per dataset on demand and evicts the least recently used ones"""
+
+    def __init__(
+        self,
+        sources: Dict[str, str],
+        default: Optional[str] = None,
+        max_memory_mb: float = 1024,
+        model_factory: Callable[[str], Model] = Model,
+        refresh_interval: float = 0,
+    ) -> None:
+        """
+        Define the datasets which can be served, nothing is loaded yet
+
+        Parameters
+        ----------
+        sources
+            mapping of dataset id to the CSV file it is loaded from
+        default
+            id of the dataset shown first, the first source if not given
+        max_memory_mb
+            cap on the total memory of the resident models, least recently used
+            models are evicted beyond it (the requested one is always kept)
+        model_factory
+            callable building a Model from a CSV file name
+        refresh_interval
+            seconds between two checks of the loaded datasets' files for appended rows
+            by the watcher, 0 disables it
+
+        Returns
+        ------
+        None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.sources = dict(sources)
+        self.default = default or next(iter(self.sources))
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self.model_factory = model_factory
+        self.refresh_interval = refresh_interval
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        self.load_locks = {dataset_id: threading.Lock() for dataset_id in sources}
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "DatasetRegistry":
+        """
+        Build the registry from the "datasets" section of config.yaml
+
+        Parameters
+        ----------
+        config
+            parsed config.yaml
+
+        Returns
+        -------
+        DatasetRegistry
+            registry of the configured sources
+        """
+        datasets = config["datasets"]
+        return cls(
+            datasets["sources"],
+            default=datasets.get("default"),
+            max_memory_mb=datasets.get("max_memory_mb", 1024),
+            model_factory=partial(
+                Model,
+                compact_dtypes=datasets.get("compact_dtypes", False),
+                quality_rules=datasets.get("quality"),
+                n_threads=datasets.get("training_threads"),
+            ),
+            refresh_interval=datasets.get("refresh_interval", 0),
+        )
+
+    def ids(self) -> List[str]:
+        """
+        List the ids of all the datasets which can be served
+
+        Returns
+        -------
+        List[str]
+            dataset ids in configuration order
+        """
+        return list(self.sources)
+
+    def get(self, dataset_id: Optional[str] = None) -> Model:
+        """
+        Return the model of a dataset, loading it on first use
+
+        Parameters
+        ----------
+        dataset_id
+            id of the dataset, the default dataset if None
+
+        Returns
+        -------
+        Model
+            the model holding the prepared data of the dataset
+        """
+        dataset_id = dataset_id or self.default
+        if dataset_id not in self.sources:
+            raise KeyError("Unknown dataset %s!" % dataset_id)
+
+        model = self.lookup(dataset_id)
+        if model is None:
+            # One lock per dataset so concurrent first requests load it only once,
+            # without blocking requests for the other datasets
+            with self.load_locks[dataset_id]:
+                model = self.lookup(dataset_id)
+                if model is None:
+                    start = time.perf_counter()
+                    model = self.model_factory(self.sources[dataset_id])
+                    self.logger.info(
+                        "Dataset %s loaded from %s in %.3fs",
+                        dataset_id,
+                        self.sources[dataset_id],
+                        time.perf_counter() - start,
+                    )
+                    with self.lock:
+                        self.models[dataset_id] = model
+                    self.evict(keep=dataset_id)
+        return model
+
+    def preload(self) -> List[str]:
+        """
+        Load the default dataset, then the other datasets in configuration order as
+        long as they fit under the memory cap, without evicting any of them
+
+        Returns
+        -------
+        List[str]
+            ids of the datasets which are resident
+        """
+        self.get()
+        for dataset_id in self.ids():
+            if self.lookup(dataset_id) is not None:
+                continue
+            if self.memory_usage() >= self.max_memory_bytes:
+                break
+            model = self.model_factory(self.sources[dataset_id])
+            if self.memory_usage() + model.memory_usage() > self.max_memory_bytes:
+                self.logger.info(
+                    "Dataset %s not preloaded, it does not fit in max_memory_mb",
+                    dataset_id,
+                )
+                continue
+            with self.lock:
+                self.models.setdefault(dataset_id, model)
+        with self.lock:
+            # The default dataset is the most likely to be requested, so the last one
+            # to be evicted
+            self.models.move_to_end(self.default)
+            return list(self.models)
+
+    def lookup(self, dataset_id: str) -> Optional[Model]:
+        """
+        Return a resident model without loading it, marking it as recently used
+
+        Parameters
+        ----------
+        dataset_id
+            id of the dataset
+
+        Returns
+        -------
+        Optional[Model]
+            the model, or None if it is not loaded
+        """
+        with self.lock:
+            model = self.models.get(dataset_id)
+            if model is not None:
+                self.models.move_to_end(dataset_id)
+            return model
+
+    def memory_usage(self) -> int:
+        """
+        Sum the memory used by all resident models
+
+        Returns
+        -------
+        int
+            total memory in bytes
+        """
+        with self.lock:
+            models = list(self.models.values())
+        return sum(model.memory_usage() for model in models)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Drop least recently used models until the memory cap is respected
+
+        Parameters
+        ----------
+        keep
+            id of a dataset which is never evicted, e.g. the one just requested
+
+        Returns
+        ------
+        None
+        """
+        while self.memory_usage() > self.max_memory_bytes:
+            with self.lock:
+                candidates = [i for i in self.models if i != keep]
+                if not candidates:
+                    return
+                self.models.pop(candidates[0])
+            self.logger.info("Dataset %s evicted from memory", candidates[0])
+
+    def refresh(self) -> Dict[str, int]:
+        """
+        Append the rows added to the files of the loaded datasets, the datasets which
+        are not loaded read the whole file when they are
+
+        Returns
+        -------
+        Dict[str, int]
+            number of rows added to each loaded dataset
+        """
+        with self.lock:
+            models = list(self.models.items())
+        added = {}
+        for dataset_id, model in models:
+            try:
+                added[dataset_id] = model.refresh()
+            except Exception:
+                self.logger.exception("Refreshing dataset %s failed", dataset_id)
+        if any(added.values()):
+            # The appended rows count towards the memory cap
+            self.evict()
+        return added
+
+    def start_watcher(self) -> Optional[threading.Thread]:
+        """
+        Start refreshing the loaded datasets periodically in a background daemon thread.
+        Threads do not survive a fork, so serve.py starts it in each worker.
+
+        Returns
+        -------
+        Optional[threading.Thread]
+            the started watcher thread, None if the refresh interval is 0
+        """
+        if not self.refresh_interval:
+            return None
+
+        def watch():
+            while True:
+                time.sleep(self.refresh_interval)
+                self.refresh()
+
+        thread = threading.Thread(
+            target=watch, name="dataset-watcher-%d" % os.getpid(), daemon=True
+        )
+        thread.start()
+        return thread
@@ -1,13 +1,52 @@
+import time
+
+# Taken before the framework imports so the startup metric covers them too
+STARTED_AT = time.perf_counter()
+
+import logging
 from flask import Flask
 from flask_session import Session
-from utils import protected_route, protect_dash_views
+from session_store import CachedSessionInterface
+from utils import get_config, protected_route, protect_dash_views
+from profiling import profile_views
 from azure_ad import app_config
 
+logger = logging.getLogger(__name__)
+
+
+def track_startup_time(server):
+    """
+    Log the time from process start to the first HTTP response served
+
+    Parameters
+    ----------
+    server
+        flask server to measure, the result is stored in its STARTUP_SECONDS config
+
+    Returns
+    ------
+    None
+    """
+    logger.info("App initialized %.3fs after start", time.perf_counter() - STARTED_AT)
+
+    @server.after_request
+    def record_first_response(response):
+        if server.config.get("STARTUP_SECONDS") is None:
+            server.config["STARTUP_SECONDS"] = time.perf_counter() - STARTED_AT
+            logger.info(
+                "First response served %.3fs after start",
+                server.config["STARTUP_SECONDS"],
+            )
+        return response
+
 
 def init_app():
     app = Flask(__name__, instance_relative_config=False)
     app.config.from_object(app_config)
-    Session(app)
+    if app.config["SESSION_TYPE"] == "sqlite":
+        app.session_interface = CachedSessionInterface.from_config(app.config)
+    else:
+        Session(app)
 
     with app.app_context():
         import routes
@@ -15,5 +54,7 @@ def init_app():
 
         app = init_dash_app(app)
         app = protect_dash_views(app)
+        app = profile_views(app, get_config())
+        track_startup_time(app.server)
 
         return app
@@ -0,0 +1,810 @@
+"""
+load_test.py
+=============================
+offline capacity test of the dashboard with concurrent virtual users
+
+The app is built with init_app() and SSO enabled, against a local stand-in for the
+Azure AD authority, and served by a threaded server on a local port in a separate
+process, so the virtual users do not compete with it for the GIL. Every virtual user
+logs in through the real /login and /retrieveToken routes, then browses the dashboard
+like a person would: switching tabs, changing the algorithm and features of the model
+and panning the map, all through _dash-update-component. Throughput and p50/p95/p99
+latency are reported per endpoint.
+
+Run it from the repository root, e.g.
+    python src/load_test.py --users 20 --duration 60
+or drive an already running server with SSO disabled (e.g. serve.py), the virtual users
+then open the dashboard without logging in
+    python src/load_test.py --users 20 --target-url http://127.0.0.1:8050
+"""
+
+import os
+import argparse
+import base64
+import html
+import json
+import logging
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import urlencode
+import numpy as np
+import requests
+import yaml
+from flask import Flask, jsonify, redirect, request
+from werkzeug.serving import make_server
+
+logger = logging.getLogger(__name__)
+
+# Host of the real authority, a well known one so msal skips the instance discovery
+AUTHORITY_HOST = "https://login.microsoftonline.com"
+TENANT = "loadtest"
+CLIENT_ID = "load-test-client"
+
+TABS = ["data_table", "data_summary", "show_model", "map"]
+ALGORITHMS = [
+    "Linear Regression",
+    "Decision Tree",
+    "Random Forest",
+    "Gradient Boosting",
+]
+FEATURES = [
+    "housing_median_age",
+    "total_rooms",
+    "total_bedrooms",
+    "population",
+    "households",
+    "median_income",
+    "rooms_per_household",
+    "population_per_household",
+    "bedrooms_per_room",
+    "ocean_proximity",
+]
+# Bounding box of the housing data, map viewports are drawn inside it
+LONGITUDE = (-124.4, -114.3)
+LATITUDE = (32.5, 42.0)
+
+
+class StubAuthority:
+    """
+    Local stand-in for the Azure AD authority: OpenID discovery, an authorize endpoint
+    which signs in whoever it is told to without a prompt and a token endpoint issuing
+    unsigned id tokens, which msal accepts as it does not verify the signature
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        """
+        Parameters
+        ----------
+        latency
+            seconds added to every response, to mimic the round trip to the real authority
+
+        Returns
+        ------
+        None
+        """
+        self.latency = latency
+        self.codes = {}
+        self.lock = threading.Lock()
+        self.url = None
+        self.server = None
+        self.app = Flask(__name__)
+        self.app.add_url_rule(
+            "/%s/v2.0/.well-known/openid-configuration" % TENANT,
+            view_func=self.configuration,
+        )
+        self.app.add_url_rule(
+            "/%s/oauth2/v2.0/authorize" % TENANT, view_func=self.authorize
+        )
+        self.app.add_url_rule(
+            "/%s/oauth2/v2.0/token" % TENANT, view_func=self.token, methods=["POST"]
+        )
+        self.app.before_request(lambda: time.sleep(self.latency))
+
+    issuer = "%s/%s/v2.0" % (AUTHORITY_HOST, TENANT)
+
+    def start(self) -> None:
+        """
+        Serve the authority on a free local port in a background thread
+
+        Returns
+        ------
+        None
+        """
+        self.server = make_server("127.0.0.1", 0, self.app, threaded=True)
+        self.url = "http://127.0.0.1:%d" % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+
+    def configuration(self):
+        # msal only accepts an https token endpoint, AuthorityClient sends it here.
+        # The browsers, i.e. the virtual users, are sent here directly to authorize.
+        return jsonify(
+            issuer=self.issuer,
+            authorization_endpoint="%s/%s/oauth2/v2.0/authorize" % (self.url, TENANT),
+            token_endpoint="%s/%s/oauth2/v2.0/token" % (AUTHORITY_HOST, TENANT),
+        )
+
+    def authorize(self):
+        code = uuid.uuid4().hex
+        with self.lock:
+            self.codes[code] = (
+                request.args["nonce"],
+                request.args.get("login_hint", "user@loadtest"),
+            )
+        query = urlencode({"code": code, "state": request.args["state"]})
+        return redirect(request.args["redirect_uri"] + "?" + query)
+
+    def token(self):
+        with self.lock:
+            nonce, username = self.codes.pop(request.form.get("code"), (None, None))
+        if username is None:
+            return jsonify(error="invalid_grant"), 400
+        now = int(time.time())
+        claims = {
+            "iss": self.issuer,
+            "sub": username,
+            "aud": CLIENT_ID,
+            "iat": now,
+            "exp": now + 3600,
+            "nonce": nonce,
+            "name": username.split("@")[0],
+            "preferred_username": username,
+        }
+        return jsonify(
+            token_type="Bearer",
+            scope="User.Read openid profile",
+            expires_in=3600,
+            access_token=uuid.uuid4().hex,
+            id_token=".".join(
+                [encode_part({"alg": "none", "typ": "JWT"}), encode_part(claims), ""]
+            ),
+        )
+
+
+class AuthorityClient(requests.Session):
+    """HTTP client for msal sending the calls to the real authority host to the stub"""
+
+    def __init__(self, stub_url: str) -> None:
+        super(AuthorityClient, self).__init__()
+        self.stub_url = stub_url
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(AUTHORITY_HOST):
+            url = self.stub_url + url[len(AUTHORITY_HOST) :]
+        return super(AuthorityClient, self).request(method, url, *args, **kwargs)
+
+
+class LatencyRecorder:
+    """Thread safe collection of request latencies per endpoint"""
+
+    def __init__(self) -> None:
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, ok: bool = True) -> None:
+        """
+        Parameters
+        ----------
+        endpoint
+            label of the endpoint, e.g. "POST scatter.figure"
+        seconds
+            latency of the request
+        ok
+            whether the request succeeded, failures are counted apart
+
+        Returns
+        ------
+        None
+        """
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def summary(self, elapsed: float) -> List[Dict]:
+        """
+        Throughput and latency percentiles of every endpoint
+
+        Parameters
+        ----------
+        elapsed
+            seconds the traffic ran for
+
+        Returns
+        -------
+        List[Dict]
+            one row per endpoint, with an "all" row last, latencies in milliseconds
+        """
+        with self.lock:
+            latencies = {k: np.array(v) for k, v in self.latencies.items()}
+            errors = dict(self.errors)
+        if latencies:
+            latencies["all"] = np.concatenate(list(latencies.values()))
+            errors["all"] = sum(errors.values())
+        rows = []
+        for endpoint, values in latencies.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            rows.append(
+                {
+                    "endpoint": endpoint,
+                    "requests": len(values),
+                    "errors": errors.get(endpoint, 0),
+                    "throughput": len(values) / elapsed,
+                    "p50_ms": p50,
+                    "p95_ms": p95,
+                    "p99_ms": p99,
+                    "max_ms": values.max() * 1000,
+                }
+            )
+        return rows
+
+
+class VirtualUser:
+    """One person logging in and clicking around the dashboard"""
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        dash_path: str,
+        recorder: LatencyRecorder,
+        think_time: float,
+        seed: Optional[int] = None,
+        sso: bool = True,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        name
+            user name given to the authority
+        base_url
+            url of the app server
+        dash_path
+            route path of the dash app
+        recorder
+            collects the latency of every request
+        think_time
+            mean pause in seconds between two actions, drawn from an exponential
+        seed
+            seed of the random choices of the user
+        sso
+            whether the app requires logging in through the authority
+
+        Returns
+        ------
+        None
+        """
+        self.name = name
+        self.sso = sso
+        self.base_url = base_url
+        self.dash_path = dash_path
+        self.recorder = recorder
+        self.think_time = think_time
+        self.random = random.Random(seed)
+        self.http = requests.Session()
+        self.tab = TABS[0]
+        self.dataset = None
+        # Stored by the model callback for the map, as the browser's dcc.Store does
+        self.fitted_model = None
+
+    def timed(self, endpoint: str, method: str, url: str, **kwargs):
+        """
+        Send a request and record its latency, redirects are not followed
+
+        Returns
+        -------
+        requests.Response
+            the response, None if the request failed to complete
+        """
+        start = time.perf_counter()
+        try:
+            response = self.http.request(method, url, allow_redirects=False, **kwargs)
+        except requests.RequestException as e:
+            self.recorder.record(endpoint, time.perf_counter() - start, ok=False)
+            logger.warning("%s %s failed: %s", self.name, endpoint, e)
+            return None
+        self.recorder.record(
+            endpoint, time.perf_counter() - start, ok=response.status_code < 400
+        )
+        return response
+
+    def login(self) -> bool:
+        """
+        Sign in through /login, the authority and /retrieveToken (unless the app does
+        not require it), then open the dashboard
+
+        Returns
+        -------
+        bool
+            whether the dashboard was served after signing in
+        """
+        if self.sso:
+            response = self.timed("GET /login", "GET", self.base_url + "/login")
+            match = response is not None and re.search(r"href='([^']+)'", response.text)
+            if not match:
+                return False
+            auth_url = html.unescape(match.group(1))
+            response = self.timed(
+                "GET authority /authorize",
+                "GET",
+                auth_url + "&" + urlencode({"login_hint": self.name}),
+            )
+            if response is None or "Location" not in response.headers:
+                return False
+            callback = response.headers["Location"]
+            self.timed("GET /retrieveToken", "GET", callback)
+
+        response = self.timed("GET " + self.dash_path, "GET", self.url(""))
+        if response is None or response.status_code != 200:
+            return False
+        response = self.timed("GET _dash-layout", "GET", self.url("_dash-layout"))
+        if response is None or response.status_code != 200:
+            return False
+        self.dataset = find_value(response.json(), "dataset")
+        self.timed("GET _dash-dependencies", "GET", self.url("_dash-dependencies"))
+        self.switch_tab(TABS[0])
+        return True
+
+    def url(self, path: str) -> str:
+        return self.base_url + self.dash_path + path
+
+    def callback(
+        self, output: str, inputs: List[Dict], changed: str, state: List[Dict] = ()
+    ) -> None:
+        """
+        Call a dash callback the way the browser does
+
+        Parameters
+        ----------
+        output
+            output of the callback, "<component id>.<property>", or the outputs of a
+            multi output callback joined the way dash does, "..<output>...<output>.."
+        inputs
+            id, property and value of every input, in the order of the callback
+        changed
+            input which triggered the call, "<component id>.<property>"
+        state
+            id, property and value of every state
+
+        Returns
+        ------
+        None
+        """
+        names = output.strip(".").split("...")
+        outputs = [dict(zip(["id", "property"], name.split("."))) for name in names]
+        body = {
+            "output": output,
+            "outputs": outputs if output.startswith("..") else outputs[0],
+            "inputs": inputs,
+            "changedPropIds": [changed],
+            "state": list(state),
+        }
+        self.timed(
+            "POST " + names[0], "POST", self.url("_dash-update-component"), json=body
+        )
+
+    def switch_tab(self, tab: str) -> None:
+        """
+        Open a tab, then run the callbacks of the components it renders
+
+        Parameters
+        ----------
+        tab
+            value of the tab
+
+        Returns
+        ------
+        None
+        """
+        self.tab = tab
+        self.callback(
+            "tabs-content.children",
+            [
+                {"id": "tabs-controller", "property": "value", "value": tab},
+                {"id": "dataset", "property": "value", "value": self.dataset},
+            ],
+            "tabs-controller.value",
+        )
+        if tab == "show_model":
+            self.change_model(ALGORITHMS[0], FEATURES)
+        elif tab == "map":
+            self.move_map("value", None)
+
+    def change_model(self, algorithm: str, features: List[str]) -> None:
+        self.callback(
+            "..scatter.figure...fitted_model.data..",
+            [
+                {"id": "algorithm", "property": "value", "value": algorithm},
+                {"id": "features", "property": "value", "value": features},
+            ],
+            "algorithm.value",
+            [{"id": "dataset", "property": "value", "value": self.dataset}],
+        )
+        self.fitted_model = {"algorithm": algorithm, "features": features}
+
+    def move_map(self, metric: str, relayout: Optional[Dict]) -> None:
+        self.callback(
+            "map.figure",
+            [
+                {"id": "map_metric", "property": "value", "value": metric},
+                {"id": "map", "property": "relayoutData", "value": relayout},
+            ],
+            "map.relayoutData",
+            [
+                {"id": "dataset", "property": "value", "value": self.dataset},
+                {"id": "fitted_model", "property": "data", "value": self.fitted_model},
+            ],
+        )
+
+    def act(self) -> None:
+        """
+        Do one random action, switching tabs or using the controls of the open tab
+
+        Returns
+        ------
+        None
+        """
+        if self.tab == "show_model" and self.random.random() < 0.6:
+            features = self.random.sample(
+                FEATURES, self.random.randint(1, len(FEATURES))
+            )
+            self.change_model(self.random.choice(ALGORITHMS), features)
+        elif self.tab == "map" and self.random.random() < 0.6:
+            width = self.random.uniform(0.5, LONGITUDE[1] - LONGITUDE[0])
+            height = width * (LATITUDE[1] - LATITUDE[0]) / (LONGITUDE[1] - LONGITUDE[0])
+            x = self.random.uniform(LONGITUDE[0], LONGITUDE[1] - width)
+            y = self.random.uniform(LATITUDE[0], LATITUDE[1] - height)
+            relayout = {
+                "xaxis.range[0]": x,
+                "xaxis.range[1]": x + width,
+                "yaxis.range[0]": y,
+                "yaxis.range[1]": y + height,
+            }
+            metric = self.random.choice(["value", "count", "residual"])
+            self.move_map(metric, relayout)
+        else:
+            self.switch_tab(self.random.choice([t for t in TABS if t != self.tab]))
+
+    def run(self, deadline: float) -> None:
+        """
+        Log in and keep acting until the deadline
+
+        Parameters
+        ----------
+        deadline
+            time.perf_counter() value at which the user stops
+
+        Returns
+        ------
+        None
+        """
+        if not self.login():
+            logger.error("%s could not log in", self.name)
+            return
+        while time.perf_counter() < deadline:
+            self.act()
+            time.sleep(self.random.expovariate(1 / self.think_time))
+
+
+def encode_part(data: Dict) -> str:
+    """
+    Encode a JWT header or payload, padding-less base64url of the JSON
+
+    Parameters
+    ----------
+    data
+        header or claims
+
+    Returns
+    -------
+    str
+        encoded part
+    """
+    raw = base64.urlsafe_b64encode(json.dumps(data).encode("utf-8"))
+    return raw.decode("ascii").rstrip("=")
+
+
+def find_value(layout, component_id: str):
+    """
+    Find the initial value of a component in a serialized dash layout
+
+    Parameters
+    ----------
+    layout
+        layout as returned by _dash-layout
+    component_id
+        id of the component
+
+    Returns
+    -------
+    Any
+        value of the component, None if it is not found
+    """
+    if isinstance(layout, dict):
+        props = layout.get("props", {})
+        if props.get("id") == component_id:
+            return props.get("value")
+        children = props.get("children")
+        return find_value(children, component_id) if children else None
+    if isinstance(layout, list):
+        for child in layout:
+            value = find_value(child, component_id)
+            if value is not None:
+                return value
+    return None
+
+
+def write_config(directory: str) -> str:
+    """
+    Copy the app config (APP_CONFIG, config.yaml by default) with SSO enabled against
+    the stub authority and profiling disabled
+
+    Parameters
+    ----------
+    directory
+        folder of the copy
+
+    Returns
+    -------
+    str
+        path of the copy
+    """
+    from utils import get_config
+
+    config = get_config()
+    config["auth"]["sso"]["enabled"] = True
+    config["auth"]["sso"]["methods"].update(
+        client_id=CLIENT_ID,
+        client_secret="load-test-secret",
+        authority="%s/%s" % (AUTHORITY_HOST, TENANT),
+    )
+    config.setdefault("profiling", {})["enabled"] = False
+    path = os.path.join(directory, "config.yaml")
+    with open(path, "w") as fp:
+        yaml.safe_dump(config, fp)
+    return path
+
+
+def start_app(authority: StubAuthority, directory: str) -> subprocess.Popen:
+    """
+    Serve the app against the stub authority in a separate process, see serve_app
+
+    Parameters
+    ----------
+    authority
+        started stub authority
+    directory
+        folder for the config copy and the session database
+
+    Returns
+    -------
+    subprocess.Popen
+        the app process, its url is the first line of its output
+    """
+    env = dict(
+        os.environ,
+        APP_CONFIG=write_config(directory),
+        SESSION_SQLITE_PATH=os.path.join(directory, "sessions.db"),
+    )
+    return subprocess.Popen(
+        [sys.executable, __file__, "--serve-app", authority.url],
+        env=env,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+
+def serve_app(authority_url: str) -> None:
+    """
+    Build the app with init_app() against the stub authority and serve it on a local
+    port until killed, this runs in the process started by start_app
+
+    Parameters
+    ----------
+    authority_url
+        url of the stub authority
+
+    Returns
+    ------
+    None
+    """
+    from flask_app import init_app
+
+    server = init_app().server
+    server.config["MSAL_HTTP_CLIENT"] = AuthorityClient(authority_url)
+    http_server = make_server("127.0.0.1", 0, server, threaded=True)
+    # One line per request would drown the results
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    print("http://127.0.0.1:%d" % http_server.server_port, flush=True)
+    http_server.serve_forever()
+
+
+def print_report(rows: List[Dict], users: int, elapsed: float) -> None:
+    """
+    Print the results as a table
+
+    Parameters
+    ----------
+    rows
+        result of LatencyRecorder.summary
+    users
+        number of virtual users
+    elapsed
+        seconds the traffic ran for
+
+    Returns
+    ------
+    None
+    """
+    print("\n%d users for %.1fs" % (users, elapsed))
+    columns = "%-36s %8s %7s %8s %9s %9s %9s %9s"
+    print(
+        columns
+        % (
+            "endpoint",
+            "requests",
+            "errors",
+            "req/s",
+            "p50 ms",
+            "p95 ms",
+            "p99 ms",
+            "max ms",
+        )
+    )
+    for row in rows:
+        print(
+            "%-36s %8d %7d %8.2f %9.1f %9.1f %9.1f %9.1f"
+            % (
+                row["endpoint"],
+                row["requests"],
+                row["errors"],
+                row["throughput"],
+                row["p50_ms"],
+                row["p95_ms"],
+                row["p99_ms"],
+                row["max_ms"],
+            )
+        )
+
+
+def run(
+    users: int,
+    duration: float,
+    think_time: float = 1.0,
+    ramp_up: float = 0.0,
+    authority_latency: float = 0.0,
+    seed: Optional[int] = None,
+    target_url: Optional[str] = None,
+) -> List[Dict]:
+    """
+    Start the stub authority and the app (unless a running app is targeted), run the
+    virtual users and summarize
+
+    Parameters
+    ----------
+    users
+        number of concurrent virtual users
+    duration
+        seconds of traffic after the ramp up starts
+    think_time
+        mean pause in seconds between two actions of a user
+    ramp_up
+        seconds over which the users start, evenly spaced
+    authority_latency
+        seconds added to every response of the stub authority
+    seed
+        seed of the random choices, for repeatable traffic
+    target_url
+        url of an already running app with SSO disabled, which is driven instead
+
+    Returns
+    -------
+    List[Dict]
+        throughput and latency percentiles per endpoint
+    """
+    authority = server = None
+    if target_url:
+        base_url = target_url.rstrip("/")
+    else:
+        directory = tempfile.mkdtemp(prefix="load_test_")
+        authority = StubAuthority(authority_latency)
+        authority.start()
+        server = start_app(authority, directory)
+        base_url = server.stdout.readline().strip()
+        if not base_url:
+            authority.stop()
+            raise RuntimeError("the app failed to start")
+        logger.info("App served on %s, authority on %s", base_url, authority.url)
+
+    from azure_ad import app_config
+
+    recorder = LatencyRecorder()
+    start = time.perf_counter()
+    deadline = start + duration
+    threads = []
+    for i in range(users):
+        user = VirtualUser(
+            "user%d@loadtest" % i,
+            base_url,
+            app_config.DASH_ROUTE_PATHNAME,
+            recorder,
+            think_time,
+            seed=None if seed is None else seed + i,
+            sso=authority is not None,
+        )
+        thread = threading.Thread(target=user.run, args=(deadline,), name=user.name)
+        threads.append(thread)
+        thread.start()
+        if ramp_up and i < users - 1:
+            time.sleep(ramp_up / users)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if server is not None:
+        server.terminate()
+        server.wait()
+        authority.stop()
+    rows = recorder.summary(elapsed)
+    print_report(rows, users, elapsed)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the dashboard latency under concurrent virtual users"
+    )
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60, help="seconds of traffic")
+    parser.add_argument(
+        "--think-time", type=float, default=1.0, help="mean seconds between actions"
+    )
+    parser.add_argument(
+        "--ramp-up", type=float, default=0.0, help="seconds to start all users"
+    )
+    parser.add_argument(
+        "--authority-latency",
+        type=float,
+        default=0.0,
+        help="seconds added to each response of the stub authority",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument(
+        "--target-url",
+        help="drive this already running app (with SSO disabled) instead of starting one",
+    )
+    # Used by start_app to serve the app in its own process
+    parser.add_argument("--serve-app", metavar="AUTHORITY_URL", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s:   %(message)s",
+        level=os.environ.get("LOGLEVEL", "WARNING").upper(),
+    )
+    if args.serve_app:
+        serve_app(args.serve_app)
+    results = run(
+        args.users,
+        args.duration,
+        think_time=args.think_time,
+        ramp_up=args.ramp_up,
+        authority_latency=args.authority_latency,
+        seed=args.seed,
+        target_url=args.target_url,
+    )
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+    sys.exit(0)
@@ -1,16 +1,65 @@
+import io
+import itertools
+import logging
+import threading
+import time
+import numpy as np
 import pandas as pd
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor
-from sklearn import tree, metrics
+from collections import OrderedDict
 from typing import Tuple, List, Dict, Optional
+from spatial_index import GridIndex
+
+# The sklearn estimator modules are slow to import, so they are imported inside
+# fit_model only once the corresponding algorithm is actually selected.
+
+logger = logging.getLogger(__name__)
+
+# Data versions are unique in the process, so a dataset which is reloaded (e.g. after
+# an eviction) never reuses the version, and so the cached tabs, of its previous load
+_data_versions = itertools.count(1)
+
+# The OpenMP thread limit is process wide: the fits which change it hold this lock, so
+# one fit ending does not restore the limit while another one is still running
+_openmp_limit_lock = threading.Lock()
+
+
+def _cache_put(entries: OrderedDict, key, value, max_entries: int) -> None:
+    # Store the most recently used entry last, evicting the oldest beyond max_entries
+    entries[key] = value
+    entries.move_to_end(key)
+    while len(entries) > max_entries:
+        entries.popitem(last=False)
 
 
 class Model:
     """Model object handles data and logic updates separate from the dashboard view"""
 
     round_digits = 2
+    # Incremented whenever the data changes, so dependent caches can be invalidated
+    data_version = 0
+    # How many one-hot encoded feature subsets are kept for refitting
+    max_cached_encodings = 8
+    # How many fitted models' residuals are kept aggregated for the map
+    max_cached_residuals = 8
+    # Store numerics as float32/int32 and text columns as categoricals when preparing data
+    compact_dtypes = False
+    categorical_columns = ["ocean_proximity"]
+    # Rules of the data quality stage (see clean_data), None skips the stage
+    quality_rules = None
+    quality_report = None
+    # Statistics of the full data reused to prepare appended rows the same way
+    fill_values = None
+    quality_bounds = None
+    # Threads used in training by the algorithms which support it, None uses all cores
+    n_threads = None
 
-    def __init__(self, data_csv: str) -> None:
+    def __init__(
+        self,
+        data_csv: str,
+        compact_dtypes: bool = False,
+        quality_rules: Optional[Dict] = None,
+        n_threads: Optional[int] = None,
+    ) -> None:
         """
         Prepare data on instance initialization, uses data frames for easy processing
 
@@ -18,16 +67,115 @@ class Model:
         ----------
         data_csv
             string with file name of where to load data
+        compact_dtypes
+            downcast the prepared data to compact types, roughly halving its memory
+        quality_rules
+            rules of the data quality stage dropping invalid rows and outliers
+        n_threads
+            number of threads used to train the gradient boosting model
 
         Returns
         ------
         None
         """
-        self.data, self.values, self.features = self.load_data(data_csv)
-        self.summary = self.summarize_data(self.data)
+        # Held while the data is changed by append and while it is read
+        self.lock = threading.RLock()
+        self.data_version = next(_data_versions)
+        self.compact_dtypes = compact_dtypes
+        self.quality_rules = quality_rules
+        self.n_threads = n_threads
+        data, values, features = self.load_data(data_csv)
+        # The prepared data, as the frames loaded and appended since it was last used
+        self.chunks = [data]
+        self.frames = (data, values, features)
+        self.summary_totals = self.group_totals(self.data)
+        self.summary = self.summarize_totals(self.summary_totals)
         self.features_list = list(self.features.columns)
-        self.algos = ["Linear Regression", "Decision Tree", "Random Forest"]
+        self.algos = [
+            "Linear Regression",
+            "Decision Tree",
+            "Random Forest",
+            "Gradient Boosting",
+        ]
         self.model = None
+        self.grid = None
+        # Chunks of the encoded features, by features subset
+        self.encodings = OrderedDict()
+        # Residuals of the fitted models by (algorithm, features), aggregated per map
+        # cell the first time the map asks for them
+        self.residuals = OrderedDict()
+        self.residual_sums = OrderedDict()
+
+    @property
+    def data(self) -> pd.DataFrame:
+        """Full prepared dataframe, including the appended rows"""
+        return self.consolidate()[0]
+
+    @property
+    def values(self) -> pd.Series:
+        """Target values (median house value) of the prepared data"""
+        return self.consolidate()[1]
+
+    @property
+    def features(self) -> pd.DataFrame:
+        """Prepared data without the target values"""
+        return self.consolidate()[2]
+
+    def consolidate(self) -> Tuple[pd.DataFrame, pd.Series, pd.DataFrame]:
+        """
+        Concatenate the chunks appended since the data was last used, so append only
+        does work proportional to the rows appended and the full copy is made once
+
+        Returns
+        ------
+        Tuple[pd.DataFrame, pd.Series, pd.DataFrame]
+            the prepared data, its target values and its features
+        """
+        with self.lock:
+            if self.frames is None:
+                data = pd.concat(self.chunks)
+                self.chunks = [data]
+                self.frames = (
+                    data,
+                    data.median_house_value,
+                    data.drop("median_house_value", axis=1),
+                )
+            return self.frames
+
+    def row_count(self) -> int:
+        """
+        Number of rows of the prepared data, without concatenating the chunks
+
+        Returns
+        ------
+        int
+            number of rows
+        """
+        with self.lock:
+            return sum(len(chunk) for chunk in self.chunks)
+
+    def head(self, rows: int) -> pd.DataFrame:
+        """
+        First rows of the prepared data, without concatenating the chunks
+
+        Parameters
+        ----------
+        rows
+            maximum number of rows
+
+        Returns
+        ------
+        pd.DataFrame
+            the first rows
+        """
+        with self.lock:
+            chunks = list(self.chunks)
+        head = []
+        for chunk in chunks:
+            head.append(chunk.iloc[: rows - sum(len(frame) for frame in head)])
+            if sum(len(frame) for frame in head) >= rows:
+                break
+        return pd.concat(head)
 
     def load_data(self, data_csv: str) -> pd.DataFrame:
         """
@@ -43,12 +191,15 @@ class Model:
         pd.DataFrame
             the data after being modified by the preparation pipeline
         """
-        # Read the data file
-        df = pd.read_csv(data_csv)
+        # Read the data file, remembering where it ends so refresh reads only new rows
+        with open(data_csv, "rb") as fp:
+            df = pd.read_csv(fp)
+            self.source, self.source_offset = data_csv, fp.tell()
+        self.source_columns = list(df.columns)
         return self.prepare_data(df)
 
     def prepare_data(
-        self, dataframe: pd.DataFrame
+        self, dataframe: pd.DataFrame, incremental: bool = False
     ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
         """
         Prepare the raw data to remove outliers, fill missing values etc.
@@ -58,6 +209,9 @@ class Model:
         ----------
         dataframe
             raw dataframe before processing
+        incremental
+            the rows are appended to the prepared data: they are filled and cleaned with
+            the statistics of the full data and are not converted to compact types
 
         Returns
         ------
@@ -80,19 +234,28 @@ class Model:
             )
 
         # Fix Missing Values
-        median_beds = dataframe["total_bedrooms"].median()
+        if not incremental:
+            self.fill_values = {"total_bedrooms": dataframe["total_bedrooms"].median()}
+        median_beds = self.fill_values["total_bedrooms"]
         dataframe["total_bedrooms"].fillna(median_beds, inplace=True)
 
-        # Add Features
-        dataframe["rooms_per_household"] = (
-            dataframe["total_rooms"] / dataframe["households"]
-        )
-        dataframe["bedrooms_per_room"] = (
-            dataframe["total_bedrooms"] / dataframe["total_rooms"]
-        )
-        dataframe["population_per_household"] = (
-            dataframe["population"] / dataframe["households"]
-        )
+        # Add Features, a zero denominator gives a missing value instead of infinity
+        households = dataframe["households"].where(dataframe["households"] != 0)
+        total_rooms = dataframe["total_rooms"].where(dataframe["total_rooms"] != 0)
+        dataframe["rooms_per_household"] = dataframe["total_rooms"] / households
+        dataframe["bedrooms_per_room"] = dataframe["total_bedrooms"] / total_rooms
+        dataframe["population_per_household"] = dataframe["population"] / households
+
+        # Remove invalid rows and outliers
+        if self.quality_rules is not None:
+            dataframe = self.clean_data(
+                dataframe,
+                self.quality_rules,
+                self.quality_bounds if incremental else None,
+            )
+
+        if self.compact_dtypes and not incremental:
+            dataframe = self.compact_data(dataframe)
 
         # Separate the target values (outputs) from the features (inputs)
         target_values = dataframe.median_house_value
@@ -100,6 +263,136 @@ class Model:
 
         return dataframe, target_values, features_df
 
+    def clean_data(
+        self,
+        dataframe: pd.DataFrame,
+        rules: Dict,
+        bounds: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ) -> pd.DataFrame:
+        """
+        Data quality stage dropping the rows which break any of the rules. All rules are
+        evaluated on the numeric columns at once as a 2D array, so the cost is linear in
+        the number of rows. The rows dropped by each rule are logged and kept in
+        quality_report, a row breaking several rules is counted for the first one only.
+
+        Parameters
+        ----------
+        dataframe
+            prepared dataframe, including the added features
+        rules
+            dictionary with the optional keys
+            "non_finite": drop rows with missing or infinite numbers (default True),
+            "caps": mapping of column to ceiling value, rows at the ceiling are dropped
+            (e.g. median_house_value is capped at 500001 in the census data),
+            "outliers": dictionary with "method" ("iqr" or "mad"), "columns" and
+            "threshold" (IQR factor, default 1.5, or modified z-score, default 3.5)
+        bounds
+            lower and upper outlier bounds of the columns, computed from the dataframe
+            and kept in quality_bounds if None
+
+        Returns
+        ------
+        pd.DataFrame
+            the rows which passed all the rules, with a fresh index
+        """
+        numeric = dataframe.select_dtypes("number")
+        values = numeric.to_numpy(dtype=np.float64)
+        finite = np.isfinite(values)
+        column_index = {column: i for i, column in enumerate(numeric.columns)}
+
+        flags = {}
+        if rules.get("non_finite", True):
+            flags["non_finite"] = ~finite.all(axis=1)
+
+        caps = rules.get("caps") or {}
+        if caps:
+            cap_columns = [column_index[column] for column in caps]
+            ceilings = np.array(list(caps.values()), dtype=np.float64)
+            flags["capped"] = (values[:, cap_columns] >= ceilings).any(axis=1)
+
+        outliers = rules.get("outliers")
+        if outliers:
+            outlier_columns = [column_index[column] for column in outliers["columns"]]
+            subset = np.where(finite, values, np.nan)[:, outlier_columns]
+            if bounds is not None:
+                lower, upper = bounds
+            elif outliers.get("method", "iqr") == "iqr":
+                q1, q3 = np.nanpercentile(subset, [25, 75], axis=0)
+                spread = outliers.get("threshold", 1.5) * (q3 - q1)
+                lower, upper = q1 - spread, q3 + spread
+            else:
+                median = np.nanmedian(subset, axis=0)
+                mad = np.nanmedian(np.abs(subset - median), axis=0)
+                # Modified z-score 0.6745 * (x - median) / MAD, no bounds when MAD is 0
+                spread = outliers.get("threshold", 3.5) * mad / 0.6745
+                spread[spread == 0] = np.inf
+                lower, upper = median - spread, median + spread
+            self.quality_bounds = (lower, upper)
+            with np.errstate(invalid="ignore"):
+                flags["outliers"] = ((subset < lower) | (subset > upper)).any(axis=1)
+
+        dropped = np.zeros(len(dataframe), dtype=bool)
+        self.quality_report = {}
+        for rule, flagged in flags.items():
+            self.quality_report[rule] = int((flagged & ~dropped).sum())
+            dropped |= flagged
+        logger.info(
+            "Quality stage dropped %d of %d rows %s",
+            dropped.sum(),
+            len(dataframe),
+            self.quality_report,
+        )
+        return dataframe[~dropped].reset_index(drop=True)
+
+    def compact_data(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        """
+        Downcast the columns to compact types, checking the range of the values only:
+        integral numbers within the int32 range become int32 (exactly), other numbers
+        within the float32 range become float32, which rounds them to about 7
+        significant digits, and the categorical columns become pandas Categoricals
+
+        Parameters
+        ----------
+        dataframe
+            prepared dataframe with default (64 bit and object) types
+
+        Returns
+        ------
+        pd.DataFrame
+            the dataframe with compact column types
+        """
+        int32_range = np.iinfo(np.int32)
+        float32_max = np.finfo(np.float32).max
+        dtypes = {}
+        for column in dataframe.columns:
+            values = dataframe[column].to_numpy()
+            if column in self.categorical_columns:
+                dtypes[column] = "category"
+            elif np.issubdtype(values.dtype, np.number) and len(values):
+                finite = values[np.isfinite(values)]
+                largest = np.abs(finite).max(initial=0)
+                if len(finite) == len(values) and (values == np.round(values)).all():
+                    # Integral numbers, kept as they are if beyond the int32 range
+                    if (
+                        int32_range.min
+                        <= values.min()
+                        <= values.max()
+                        <= int32_range.max
+                    ):
+                        dtypes[column] = np.int32
+                elif largest <= float32_max:
+                    dtypes[column] = np.float32
+
+        before = dataframe.memory_usage(deep=True).sum()
+        dataframe = dataframe.astype(dtypes)
+        after = dataframe.memory_usage(deep=True).sum()
+        logger.info(
+            "Compact types reduced the data from %.1fMB to %.1fMB",
+            before / 1024**2,
+            after / 1024**2,
+        )
+        return dataframe
+
     def summarize_data(self, dataframe: pd.DataFrame) -> Dict[str, List[float]]:
         """
         Using aggregation methods, group the data by house age for display in a stacked bar chart
@@ -115,40 +408,332 @@ class Model:
             With keys for "young", "medium", "old" groups, list of the average house prices by distance to ocean
         """
 
+        return self.summarize_totals(self.group_totals(dataframe))
+
+    def group_totals(self, dataframe: pd.DataFrame) -> Optional[pd.DataFrame]:
+        """
+        Sum and count the house values per age group and distance to ocean. Unlike the
+        averages, the totals of appended rows can simply be added to the previous ones
+
+        Parameters
+        ----------
+        dataframe
+            datafrome table to summarize
+
+        Returns
+        ------
+        Optional[pd.DataFrame]
+            "sum" and "count" columns indexed by the age group ("young", "medium" or
+            "old") and ocean_proximity, None if a required column is missing
+        """
         # Check that required columns exist
         if not set(["housing_median_age", "ocean_proximity"]).issubset(
             dataframe.columns
         ):
-            return {"young": [], "medium": [], "old": []}
-
-        # Aggregate and average
-        young = (
-            dataframe.where(dataframe["housing_median_age"] < 15.0)
-            .groupby("ocean_proximity")
-            .mean()
-            .round(self.round_digits)
+            return None
+
+        age = dataframe["housing_median_age"].to_numpy()
+        group = pd.Series(
+            np.select(
+                [age < 15.0, age < 30.0, age >= 30.0], ["young", "medium", "old"], ""
+            ),
+            index=dataframe.index,
         )
-        medium = (
-            dataframe.where(
-                (dataframe["housing_median_age"] < 30.0)
-                & (dataframe["housing_median_age"] >= 15.0)
-            )
-            .groupby("ocean_proximity")
-            .mean()
-            .round(self.round_digits)
+        # Only the categories which are present are kept when ocean_proximity is categorical
+        totals = (
+            dataframe["median_house_value"]
+            .groupby([group, dataframe["ocean_proximity"]], observed=True)
+            .agg(["sum", "count"])
+        )
+        return totals.drop("", level=0, errors="ignore")
+
+    def summarize_totals(
+        self, totals: Optional[pd.DataFrame]
+    ) -> Dict[str, List[float]]:
+        """
+        Average house prices by distance to ocean of each age group
+
+        Parameters
+        ----------
+        totals
+            sums and counts as computed by group_totals
+
+        Returns
+        ------
+        Dict[str, List[float]]
+            With keys for "young", "medium", "old" groups, list of the average house prices by distance to ocean
+        """
+        summary = {"young": [], "medium": [], "old": []}
+        if totals is None:
+            return summary
+        for group in summary:
+            if group in totals.index.get_level_values(0):
+                # Sorted by ocean_proximity, whatever the order of the rows
+                group_totals = totals.xs(group, level=0).sort_index()
+                means = group_totals["sum"] / group_totals["count"]
+                summary[group] = means.round(self.round_digits).tolist()
+        return summary
+
+    def encode_features(self, features_include: List[str]) -> pd.DataFrame:
+        """
+        Restrict the features to a subset and one-hot encode the categorical column (if present).
+        The most recently used encodings are cached since refitting often reuses a subset
+
+        Parameters
+        ----------
+        features_include
+            list of the features (frame columns) which should be inputs
+
+        Returns
+        ------
+        pd.DataFrame
+            the encoded features ready to be used for fitting
+        """
+        key = tuple(features_include)
+        with self.lock:
+            if key in self.encodings:
+                self.encodings.move_to_end(key)
+                chunks = self.encodings[key]
+                if len(chunks) > 1:
+                    # Rows were appended since it was last used
+                    chunks[:] = [pd.concat(chunks)]
+                return chunks[0]
+
+            features_encoded = pd.get_dummies(self.features[features_include])
+            self.encodings[key] = [features_encoded]
+            while len(self.encodings) > self.max_cached_encodings:
+                self.encodings.popitem(last=False)
+            return features_encoded
+
+    def append(self, rows: pd.DataFrame) -> int:
+        """
+        Add raw rows to the data without preparing it again. The rows are prepared with
+        the statistics of the full data, then added as a new chunk of the data and of
+        the cached encodings, and to the summary totals and the map grid, so the work
+        is proportional to the rows appended (the chunks are concatenated when the data
+        is next used). The data version is incremented, which invalidates the cached tabs.
+
+        Parameters
+        ----------
+        rows
+            raw rows with the columns of the CSV file
+
+        Returns
+        ------
+        int
+            number of rows added, after the data quality stage
+        """
+        start = time.perf_counter()
+        with self.lock:
+            report = self.quality_report
+            data, values, features = self.prepare_data(rows.copy(), incremental=True)
+            if report is not None and self.quality_report is not None:
+                self.quality_report = {
+                    rule: report.get(rule, 0) + self.quality_report.get(rule, 0)
+                    for rule in {**report, **self.quality_report}
+                }
+            if data.empty:
+                return 0
+
+            rows_before = self.row_count()
+            data.index = pd.RangeIndex(rows_before, rows_before + len(data))
+            # Everything is computed before any state is changed, so a failure leaves
+            # the data as it was
+            chunks, data = self.conform_types(data)
+            delta_totals = self.group_totals(data)
+            summary_totals = self.summary_totals
+            if delta_totals is not None:
+                summary_totals = summary_totals.add(delta_totals, fill_value=0)
+            summary = self.summarize_totals(summary_totals)
+            new_features = data.drop("median_house_value", axis=1)
+            encodings = OrderedDict()
+            for key, encoded in self.encodings.items():
+                added = pd.get_dummies(new_features[list(key)])
+                if not set(added.columns).issubset(encoded[0].columns):
+                    # A new category adds a column, encode it again when next used
+                    continue
+                added = added.reindex(columns=encoded[0].columns, fill_value=0)
+                encodings[key] = encoded + [added.astype(encoded[0].dtypes.to_dict())]
+
+            if self.grid is not None:
+                self.grid.add_points(
+                    data["longitude"].to_numpy(),
+                    data["latitude"].to_numpy(),
+                    data["median_house_value"].to_numpy(),
+                )
+            self.chunks = chunks + [data]
+            self.frames = None
+            self.summary_totals = summary_totals
+            self.summary = summary
+            self.encodings = encodings
+            # The residuals were of the models fitted to the previous rows
+            self.residuals.clear()
+            self.residual_sums.clear()
+            self.data_version = next(_data_versions)
+
+        logger.info(
+            "Appended %d of %d rows in %.3fs",
+            len(data),
+            len(rows),
+            time.perf_counter() - start,
         )
-        old = (
-            dataframe.where(dataframe["housing_median_age"] >= 30.0)
-            .groupby("ocean_proximity")
-            .mean()
-            .round(self.round_digits)
+        return len(data)
+
+    def conform_types(
+        self, dataframe: pd.DataFrame
+    ) -> Tuple[List[pd.DataFrame], pd.DataFrame]:
+        """
+        Give appended rows the column types of the data where their values fit, so the
+        compact types are kept. Categories which are new are added to the data's, in
+        copies of its chunks as the data itself is left unchanged.
+
+        Parameters
+        ----------
+        dataframe
+            prepared rows with default (64 bit and object) types
+
+        Returns
+        ------
+        Tuple[List[pd.DataFrame], pd.DataFrame]
+            the chunks of the data with the new categories, and the rows with the
+            types of the data
+        """
+        chunks = list(self.chunks)
+        dtypes = {}
+        for column, dtype in chunks[0].dtypes.items():
+            if column not in dataframe.columns:
+                continue
+            if isinstance(dtype, pd.CategoricalDtype):
+                present = dataframe[column].dropna().unique()
+                categories = sorted(set(dtype.categories).union(present))
+                if len(categories) > len(dtype.categories):
+                    dtype = pd.CategoricalDtype(categories)
+                    chunks = [chunk.astype({column: dtype}) for chunk in chunks]
+                dtypes[column] = dtype
+            elif dtype != dataframe[column].dtype:
+                # Same rules as compact_data: integers must be exact, floats in range
+                values = dataframe[column].to_numpy()
+                with np.errstate(invalid="ignore", over="ignore"):
+                    converted = values.astype(dtype)
+                if np.issubdtype(dtype, np.integer):
+                    fits = np.array_equal(converted, values)
+                else:
+                    fits = np.array_equal(np.isfinite(converted), np.isfinite(values))
+                if fits:
+                    dtypes[column] = dtype
+        return chunks, dataframe.astype(dtypes)
+
+    def refresh(self) -> int:
+        """
+        Append the rows added to the end of the CSV file since it was last read
+
+        Returns
+        ------
+        int
+            number of rows added, after the data quality stage
+        """
+        with open(self.source, "rb") as fp:
+            fp.seek(0, io.SEEK_END)
+            if fp.tell() < self.source_offset:
+                logger.warning("%s was truncated, restart to reload it", self.source)
+                return 0
+            fp.seek(self.source_offset)
+            chunk = fp.read()
+        # A line which is still being written is read on the next refresh
+        end = chunk.rfind(b"\n") + 1
+        if not end:
+            return 0
+        rows = pd.read_csv(
+            io.BytesIO(chunk[:end]), header=None, names=self.source_columns
         )
+        # Only skip the rows once they are appended, so they are read again when the
+        # append fails
+        added = self.append(rows)
+        self.source_offset += end
+        return added
+
+    def memory_usage(self) -> int:
+        """
+        Estimate the memory held by the data and the cached encodings
+
+        Returns
+        ------
+        int
+            memory in bytes
+        """
+        with self.lock:
+            frames = list(self.chunks)
+            if self.frames is not None:
+                frames += self.frames[1:]
+            for chunks in self.encodings.values():
+                frames += chunks
+        memory = sum(np.sum(frame.memory_usage(deep=True)) for frame in frames)
+        if self.grid is not None:
+            memory += self.grid.memory_usage()
+        memory += sum(residuals.nbytes for residuals in list(self.residuals.values()))
+        for pyramid in list(self.residual_sums.values()):
+            memory += sum(grid.nbytes for grid in pyramid)
+        return int(memory)
+
+    def spatial_index(self) -> Optional[GridIndex]:
+        """
+        Grid index of the house locations, built on first use
+
+        Returns
+        ------
+        Optional[GridIndex]
+            index aggregating the house values per cell, None if the data has no
+            longitude/latitude
+        """
+        # Built under the lock so the locations and the values are of the same rows,
+        # the rows appended later are added to the index by append
+        with self.lock:
+            if self.grid is None and {"longitude", "latitude"}.issubset(
+                self.data.columns
+            ):
+                self.grid = GridIndex(
+                    self.data["longitude"].to_numpy(),
+                    self.data["latitude"].to_numpy(),
+                    self.values.to_numpy(),
+                )
+            return self.grid
 
-        return {
-            "young": young["median_house_value"].tolist(),
-            "medium": medium["median_house_value"].tolist(),
-            "old": old["median_house_value"].tolist(),
-        }
+    def residual_sum(
+        self, algorithm: Optional[str], features_include: Optional[List[str]]
+    ) -> Optional[List[np.ndarray]]:
+        """
+        Residuals of a model fitted with fit_model, aggregated per cell of the spatial
+        index (on the first call for that model) to be passed to its query
+
+        Parameters
+        ----------
+        algorithm
+            name of the algorithm of the fitted model
+        features_include
+            list of the features of the fitted model
+
+        Returns
+        ------
+        Optional[List[np.ndarray]]
+            residual sums per level of the index, None if no such model was fitted to
+            the current rows
+        """
+        if algorithm is None or features_include is None:
+            return None
+        key = (algorithm, tuple(features_include))
+        with self.lock:
+            pyramid = self.residual_sums.get(key)
+            if pyramid is not None:
+                self.residual_sums.move_to_end(key)
+                return pyramid
+            residuals = self.residuals.get(key)
+            grid = self.spatial_index() if residuals is not None else None
+            if grid is None:
+                return None
+            pyramid = grid.aggregate(residuals)
+            del self.residuals[key]
+            _cache_put(self.residual_sums, key, pyramid, self.max_cached_residuals)
+            return pyramid
 
     def fit_model(
         self,
@@ -166,7 +751,7 @@ class Model:
         features_include
             list of the features (frame columns) which should be inputs
         random_state
-            random state passed to RandomForest training. Use non-None values to get reproducible training outcome
+            random state passed to RandomForest and Gradient Boosting training. Use non-None values to get reproducible training outcome
 
         Returns
         ------
@@ -174,23 +759,64 @@ class Model:
             Single column df of the real values, the single column df of model predictions, r2 metric of accuracy
         """
 
-        # Restrict data frame to the selected features
-        features_subset = self.features[features_include]
-
-        # One-Hot Encode categorical column (if present)
-        features_encoded = pd.get_dummies(features_subset)
+        # Restrict data frame to the selected features and One-Hot Encode, along with
+        # the values of the same rows in case rows are appended meanwhile
+        with self.lock:
+            features_encoded = self.encode_features(features_include)
+            values = self.values
 
-        # Create a model object for the selected algorithm
+        # Create a model object for the selected algorithm, it is only stored once fitted
+        # so concurrent fits on the same dataset do not use each other's estimator
         if algorithm == "Linear Regression":
-            self.model = LinearRegression()
+            from sklearn.linear_model import LinearRegression
+
+            model = LinearRegression()
         elif algorithm == "Decision Tree":
-            self.model = tree.DecisionTreeRegressor(max_depth=12, max_leaf_nodes=30)
+            from sklearn.tree import DecisionTreeRegressor
+
+            model = DecisionTreeRegressor(max_depth=12, max_leaf_nodes=30)
+        elif algorithm == "Gradient Boosting":
+            from sklearn.ensemble import HistGradientBoostingRegressor
+
+            # Bins the features into histograms, which makes it much faster to train
+            # than the random forest on large data, and stops adding trees once the
+            # score on a held out validation fraction stops improving
+            model = HistGradientBoostingRegressor(
+                max_iter=300, early_stopping=True, random_state=random_state
+            )
+        else:
+            from sklearn.ensemble import RandomForestRegressor
+
+            model = RandomForestRegressor(random_state=random_state)
+
+        # Fit the selected model and make predictions, limiting the OpenMP threads of
+        # the gradient boosting (the only algorithm using OpenMP) if configured
+        from sklearn.metrics import r2_score
+        from threadpoolctl import threadpool_limits
+
+        if algorithm == "Gradient Boosting" and self.n_threads is not None:
+            with _openmp_limit_lock, threadpool_limits(
+                limits=self.n_threads, user_api="openmp"
+            ):
+                model.fit(features_encoded, values)
+                predictions = model.predict(features_encoded)
         else:
-            self.model = RandomForestRegressor(random_state=random_state)
+            model.fit(features_encoded, values)
+            predictions = model.predict(features_encoded)
+        self.model = model
+        r2 = r2_score(predictions, values)
 
-        # Fit the selected model and make predictions
-        self.model.fit(features_encoded, self.values)
-        predictions = self.model.predict(features_encoded)
-        r2 = metrics.r2_score(predictions, self.values)
+        # Keep the residuals for the map of this algorithm and features, unless rows
+        # were appended meanwhile, residual_sum aggregates them if the map asks
+        with self.lock:
+            if values is self.values:
+                key = (algorithm, tuple(features_include))
+                self.residual_sums.pop(key, None)
+                _cache_put(
+                    self.residuals,
+                    key,
+                    values.to_numpy() - predictions,
+                    self.max_cached_residuals,
+                )
 
-        return self.values, predictions, r2
+        return values, predictions, r2
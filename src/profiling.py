@@ -0,0 +1,233 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from typing import Dict, Optional
+from flask import request, session
+
+
+class SamplingProfiler:
+    """Samples the call stack of one thread at a fixed interval from a background thread"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005) -> None:
+        """
+        Prepare the sampler, nothing is sampled before start is called
+
+        Parameters
+        ----------
+        thread_id
+            identifier of the thread to sample, as given by threading.get_ident
+        interval
+            seconds between two samples
+
+        Returns
+        ------
+        None
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.run, name="profiler", daemon=True)
+
+    def start(self) -> None:
+        """
+        Start sampling in the background
+
+        Returns
+        ------
+        None
+        """
+        self.sampler.start()
+
+    def stop(self) -> None:
+        """
+        Stop sampling and wait for the last sample to be recorded
+
+        Returns
+        ------
+        None
+        """
+        self.stopped.set()
+        self.sampler.join()
+
+    def run(self) -> None:
+        """
+        Record the stack of the sampled thread until stopped, the profiled thread itself
+        runs untouched which keeps the overhead low
+
+        Returns
+        ------
+        None
+        """
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    "%s (%s:%d)"
+                    % (
+                        code.co_name,
+                        os.path.basename(code.co_filename),
+                        code.co_firstlineno,
+                    )
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        """
+        Format the samples as folded stacks, the input format of flamegraph.pl and speedscope
+
+        Returns
+        -------
+        str
+            one line per distinct stack with the frames separated by ";" and the sample count
+        """
+        return "".join("%s %d\n" % item for item in self.stacks.items())
+
+
+class RateLimiter:
+    """Token bucket allowing a number of events per minute"""
+
+    def __init__(self, per_minute: float) -> None:
+        """
+        Parameters
+        ----------
+        per_minute
+            number of events allowed per minute, also the size of a burst
+
+        Returns
+        ------
+        None
+        """
+        self.per_minute = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Take a token if one is available
+
+        Returns
+        -------
+        bool
+            whether the event is allowed
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.per_minute,
+                self.tokens + (now - self.updated) * self.per_minute / 60,
+            )
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def profile_views(app, config: Dict):
+    """
+    Wrap every view of the server, dash callbacks included, with the sampling profiler.
+    A request is profiled when profiling is enabled (config or PROFILING=1 environment
+    variable) or when it has the profiling header and comes from an authorized user,
+    and the rate limit allows it. Each profile is written as a folded stacks file.
+
+    Parameters
+    ----------
+    app
+        dash app whose server views get wrapped
+    config
+        parsed config.yaml, the settings are in the "profiling" section
+
+    Returns
+    ------
+    Dash
+        the same app, for chaining like protect_dash_views
+    """
+    settings = config.get("profiling") or {}
+    enabled = settings.get("enabled", False) or os.environ.get("PROFILING") == "1"
+    header = settings.get("header", "X-Profile")
+    authorized_users = set(settings.get("authorized_users") or [])
+    sso_enabled = config["auth"]["sso"]["enabled"]
+    directory = settings.get("directory", "profiles")
+    interval = settings.get("interval_ms", 5) / 1000
+    limiter = RateLimiter(settings.get("max_profiles_per_minute", 6))
+
+    def requested() -> bool:
+        if not request.headers.get(header):
+            return False
+        # Without SSO every visitor already has full access
+        user = (session.get("user") or {}).get("preferred_username")
+        return not sso_enabled or user in authorized_users
+
+    def profiled(view):
+        @wraps(view)
+        def wrapped_view(*args, **kwargs):
+            if not (enabled or requested()) or not limiter.allow():
+                return view(*args, **kwargs)
+            profiler = SamplingProfiler(threading.get_ident(), interval)
+            profiler.start()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                profiler.stop()
+                write_profile(directory, profile_name(), profiler.folded())
+
+        return wrapped_view
+
+    for endpoint, view in list(app.server.view_functions.items()):
+        app.server.view_functions[endpoint] = profiled(view)
+    return app
+
+
+def profile_name() -> str:
+    """
+    Name a profile after the request, with the callback output for dash callbacks
+
+    Returns
+    -------
+    str
+        file name safe label of the current request
+    """
+    label = request.endpoint or "request"
+    body = request.get_json(silent=True) if request.is_json else None
+    if isinstance(body, dict) and body.get("output"):
+        label += "-" + body["output"]
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")
+
+
+def write_profile(directory: str, name: str, folded: str) -> Optional[str]:
+    """
+    Write a profile to the profiles directory
+
+    Parameters
+    ----------
+    directory
+        folder of the profiles, created if missing
+    name
+        label of the profiled request
+    folded
+        samples in folded stacks format
+
+    Returns
+    -------
+    Optional[str]
+        path of the written file, None if there were no samples
+    """
+    if not folded:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(
+        directory, "%d-%d-%s.folded" % (time.time() * 1000, os.getpid(), name)
+    )
+    with open(path, "w") as fp:
+        fp.write(folded)
+    return path
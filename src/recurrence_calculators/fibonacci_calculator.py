@@ -1,5 +1,6 @@
 import logging
-from typing import List
+from array import array
+from typing import List, Optional, Tuple
 
 
 class RecurrenceCalculator:
@@ -8,7 +9,11 @@ class RecurrenceCalculator:
     # define recurrence relation of type r[n] = c[0]*r[n+o[0]] + c[1]*r[n+o[1]] + ...
     # so offsets = [-1, -2] and coefficients = [1, 1] would be r[n] = r[n-1] + r[n-2]
     def __init__(
-        self, offsets: List[int], coefficients: List[float], sequence: List[float]
+        self,
+        offsets: List[int],
+        coefficients: List[float],
+        sequence: List[float],
+        modulus: Optional[int] = None,
     ) -> None:
         """
         Define the recurrence definition and initial terms
@@ -21,6 +26,9 @@ class RecurrenceCalculator:
             list of the coefficients corresponding to the offsets
         sequence
             starting few values of the recurrence from index 0
+        modulus
+            compute the values modulo this integer, only the residues are stored and
+            the sequence repeats from some index on, see compute
 
         Returns
         ------
@@ -29,11 +37,44 @@ class RecurrenceCalculator:
         self.logger = logging.getLogger()
         self.offsets = offsets
         self.coefficients = coefficients
-        self.computed_values = {}
-        for i, val in enumerate(sequence):
-            self.computed_values[i] = val
+        self.modulus = modulus
         if len(self.offsets) != len(self.coefficients):
             self.logger.error("mismatching input lengths in definition!")
+        if modulus is not None:
+            if not isinstance(modulus, int) or not 0 < modulus < 2**63:
+                raise ValueError("modulus must be an integer from 1 to 2**63 - 1")
+            if not all(isinstance(c, int) for c in coefficients):
+                raise ValueError("coefficients must be integers with a modulus")
+            if not all(isinstance(o, int) and o < 0 for o in offsets):
+                raise ValueError("offsets must be negative integers with a modulus")
+            # Number of previous values a value depends on
+            self.order = -min(offsets, default=-1)
+        self.seed(sequence)
+
+    def seed(self, sequence: List[float]) -> None:
+        """
+        Forget the computed values and start again from a seed sequence
+
+        Parameters
+        ----------
+        sequence
+            starting few values of the recurrence from index 0
+
+        Returns
+        ------
+        None
+        """
+        if self.modulus is None:
+            self.computed_values = dict(enumerate(sequence))
+            return
+        if len(sequence) < self.order:
+            raise ValueError("the sequence needs at least %d values" % self.order)
+        # Residues fit in 64 bits, so they are stored contiguously by index
+        self.computed_values = array("q", (int(v) % self.modulus for v in sequence))
+        self.preperiod = None
+        self.period = None
+        # First index whose state (the order values before it) determines the rest
+        self.cycle_start = max(len(sequence), self.order)
 
     def compute(self, index: int) -> float:
         """
@@ -51,6 +92,8 @@ class RecurrenceCalculator:
         """
         if index < 0:
             raise Exception("requested negative index %d!" % index)
+        if self.modulus is not None:
+            return self.compute_residue(index)
         if index not in self.computed_values:
             self.logger.debug("computing value at n=%d", index)
             self.computed_values[index] = sum(
@@ -61,6 +104,118 @@ class RecurrenceCalculator:
             )
         return self.computed_values[index]
 
+    def compute_residue(self, index: int) -> int:
+        """
+        Generates the value modulo the modulus. The values are computed in order while
+        looking for a cycle, once found any index is reduced into the stored values,
+        so time and memory are bounded by the length of the cycle instead of the index
+
+        Parameters
+        ----------
+        index
+            input index to either lookup or compute
+
+        Returns
+        -------
+        int
+            value of the recurrence at n modulo the modulus
+        """
+        values = self.computed_values
+        if index >= len(values) and self.period is not None:
+            index = self.preperiod + (index - self.preperiod) % self.period
+        while index >= len(values) and self.period is None:
+            self.append_residue()
+            self.detect_cycle()
+        if index >= len(values):
+            index = self.preperiod + (index - self.preperiod) % self.period
+        return values[index]
+
+    def append_residue(self) -> None:
+        """
+        Compute the residue following the stored ones
+
+        Returns
+        ------
+        None
+        """
+        n = len(self.computed_values)
+        self.logger.debug("computing value at n=%d", n)
+        self.computed_values.append(
+            sum(
+                c * self.computed_values[n + o]
+                for c, o in zip(self.coefficients, self.offsets)
+            )
+            % self.modulus
+        )
+
+    def state(self, index: int) -> array:
+        """
+        The values before an index, which determine all the values from it on
+
+        Parameters
+        ----------
+        index
+            index at least the order of the recurrence
+
+        Returns
+        -------
+        array
+            the order residues before the index
+        """
+        return self.computed_values[index - self.order : index]
+
+    def detect_cycle(self) -> None:
+        """
+        One step of Brent's cycle detection on the states, run after each new value.
+        The tortoise stays on a state while the hare moves on, and jumps to the hare
+        after powers of two steps, so a cycle of length lam is found in O(mu + lam)
+        steps with only two states compared at a time.
+
+        Returns
+        ------
+        None
+        """
+        hare = len(self.computed_values)
+        if hare <= self.cycle_start:
+            return
+        if hare == self.cycle_start + 1:
+            self.tortoise, self.power, self.lam = self.cycle_start, 1, 1
+        if self.state(self.tortoise) != self.state(hare):
+            if self.power == self.lam:
+                self.tortoise, self.power, self.lam = hare, self.power * 2, 0
+            self.lam += 1
+            return
+
+        # The period is known, the cycle starts at the first state equal to the one
+        # a period later, the values repeat from the order values before it
+        start = self.cycle_start
+        while self.state(start) != self.state(start + self.lam):
+            start += 1
+            while start + self.lam > len(self.computed_values):
+                self.append_residue()
+        self.preperiod, self.period = start - self.order, self.lam
+        # Only one period of values is needed to answer any index
+        del self.computed_values[self.preperiod + self.period :]
+        self.logger.debug(
+            "values repeat every %d after %d", self.period, self.preperiod
+        )
+
+    def cycle(self) -> Tuple[int, int]:
+        """
+        Compute values until the residues repeat, only with a modulus
+
+        Returns
+        -------
+        Tuple[int, int]
+            index from which the values repeat, and length of the period
+        """
+        if self.modulus is None:
+            raise Exception("only residues modulo a modulus have a cycle!")
+        while self.period is None:
+            self.append_residue()
+            self.detect_cycle()
+        return self.preperiod, self.period
+
     def count(self) -> int:
         """
         Looks up how many values are currently cached
@@ -70,17 +225,22 @@ class RecurrenceCalculator:
         int
             how many stored values this calculator has computed
         """
-        return len(self.computed_values.keys())
+        return len(self.computed_values)
 
 
 class FibonacciCalculator(RecurrenceCalculator):
     """Extended class with specific starting inputs for fibonacci calculation"""
 
-    def __init__(self) -> None:
+    def __init__(self, modulus: Optional[int] = None) -> None:
         """
         Inherited constructor with hard coded update rule
+
+        Parameters
+        ----------
+        modulus
+            compute the values modulo this integer, see RecurrenceCalculator
         """
-        super(FibonacciCalculator, self).__init__([-1, -2], [1, 1], [1, 1])
+        super(FibonacciCalculator, self).__init__([-1, -2], [1, 1], [1, 1], modulus)
 
     def reset_start(self, sequence: List[float]) -> None:
         """
@@ -95,6 +255,4 @@ class FibonacciCalculator(RecurrenceCalculator):
         -------
         None
         """
-        self.computed_values = {}
-        for i, val in enumerate(sequence):
-            self.computed_values[i] = val
+        self.seed(sequence)
@@ -0,0 +1,117 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+from flask import current_app, request
+
+
+class CallbackResponseCache:
+    """Serves pre-serialized dash callback responses without running the callback"""
+
+    def __init__(
+        self,
+        output: str,
+        key_func: Callable[[Dict], Optional[Hashable]],
+        max_entries: int = 64,
+    ) -> None:
+        """
+        Define which callback output is cached and how requests map to cache entries
+
+        Parameters
+        ----------
+        output
+            callback output id as sent by the dash renderer, e.g. "tabs-content.children"
+        key_func
+            maps the callback request body to a hashable key (which should include the
+            data version), or None when the request should not be cached
+        max_entries
+            number of serialized responses kept before the oldest is evicted
+
+        Returns
+        ------
+        None
+        """
+        self.output = output
+        self.key_func = key_func
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def install(self, app):
+        """
+        Wrap the dash callback dispatch view so cached outputs skip the callback entirely
+
+        Parameters
+        ----------
+        app
+            dash app whose dispatch view gets wrapped
+
+        Returns
+        ------
+        Dash
+            the same app, for chaining like protect_dash_views
+        """
+        endpoint = app.config.routes_pathname_prefix + "_dash-update-component"
+        dispatch = app.server.view_functions[endpoint]
+
+        def cached_dispatch(*args, **kwargs):
+            body = request.get_json(silent=True) or {}
+            key = self.key_func(body) if body.get("output") == self.output else None
+            if key is None:
+                return dispatch(*args, **kwargs)
+
+            data = self.get(key)
+            if data is None:
+                response = dispatch(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                data = self.put(key, response.get_data())
+
+            # Callbacks are POST requests, which HTTP does not answer with a 304, so the
+            # body is always sent: the cache saves the callback and its serialization
+            return current_app.response_class(data, mimetype="application/json")
+
+        app.server.view_functions[endpoint] = cached_dispatch
+        return app
+
+    def get(self, key: Hashable):
+        """
+        Lookup a serialized response, marking it as recently used
+
+        Parameters
+        ----------
+        key
+            cache key produced by key_func
+
+        Returns
+        -------
+        Optional[bytes]
+            the response body, or None if not cached
+        """
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def put(self, key: Hashable, data: bytes):
+        """
+        Store a serialized response, evicting the least recently used beyond max_entries
+
+        Parameters
+        ----------
+        key
+            cache key produced by key_func
+        data
+            serialized JSON body of the callback response
+
+        Returns
+        -------
+        bytes
+            the response body
+        """
+        with self.lock:
+            self.entries[key] = data
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return data
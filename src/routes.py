@@ -77,6 +77,7 @@ def _build_msal_app(cache=None, authority=None):
         authority=authority or auth_sso["authority"],
         client_credential=auth_sso["client_secret"],
         token_cache=cache,
+        http_client=app.config.get("MSAL_HTTP_CLIENT"),
     )
 
 
@@ -0,0 +1,264 @@
+"""
+serve.py
+=============================
+production entry point of the dashboard, an alternative to the debug server of app.py
+
+The app and the prepared data of the datasets (those which fit under max_memory_mb) are
+built once in a master process, which then forks the workers. The workers inherit the
+data frames copy-on-write, so adding workers to use more cores does not multiply the
+dataset memory.
+"""
+
+import os
+
+# Threads must not be running when forking, the datasets are preloaded instead and
+# the dataset watcher is started in each worker
+os.environ["MODEL_WARMUP"] = "false"
+os.environ["DATA_WATCH"] = "false"
+
+import argparse
+import gc
+import logging
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer
+
+log_level = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(format="%(asctime)s %(levelname)s:   %(message)s", level=log_level)
+logger = logging.getLogger()
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    WSGI server handling the requests with a fixed size pool of threads. The next
+    connection is only accepted once a thread is free, so under overload connections
+    wait in the listen backlog (or go to another worker) instead of piling up in memory.
+    """
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, threads: int, fd: int) -> None:
+        """
+        Serve on an already listening socket inherited from the master process
+
+        Parameters
+        ----------
+        host
+            host the socket is bound to
+        port
+            port the socket is bound to
+        app
+            WSGI application to serve
+        threads
+            number of requests handled concurrently by this worker
+        fd
+            file descriptor of the listening socket
+
+        Returns
+        ------
+        None
+        """
+        super(PooledWSGIServer, self).__init__(host, port, app, fd=fd)
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix="request")
+        self.free_threads = threading.Semaphore(threads)
+
+    def process_request(self, request, client_address) -> None:
+        # Blocks the accepting loop until a thread is free
+        self.free_threads.acquire()
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.free_threads.release()
+
+
+def preload():
+    """
+    Build the app and load the prepared data of the datasets in the current process,
+    the default dataset then the others which fit under the datasets max_memory_mb
+
+    Returns
+    -------
+    Flask
+        the flask server of the dash app
+    """
+    from flask_app import init_app
+    from dash_app import registry
+
+    app = init_app()
+    for dataset_id in registry.preload():
+        model = registry.get(dataset_id)
+        # The dashboard starts with all the features checked, encode them once here
+        model.encode_features(model.features_list)
+    # Move everything allocated so far out of the collector's reach, otherwise the
+    # collections in the workers would write to (and so copy) the shared pages
+    gc.collect()
+    gc.freeze()
+    return app.server
+
+
+def run_worker(server, sock: socket.socket, threads: int) -> None:
+    """
+    Serve requests forever, this runs in the forked worker processes
+
+    Parameters
+    ----------
+    server
+        WSGI application to serve
+    sock
+        listening socket shared by all the workers
+    threads
+        number of requests handled concurrently by this worker
+
+    Returns
+    ------
+    None
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    from dash_app import registry
+
+    registry.start_watcher()
+    host, port = sock.getsockname()[:2]
+    PooledWSGIServer(host, port, server, threads, sock.fileno()).serve_forever()
+
+
+def spawn_worker(server, sock: socket.socket, threads: int) -> int:
+    """
+    Fork a worker process
+
+    Parameters
+    ----------
+    server
+        WSGI application to serve
+    sock
+        listening socket shared by all the workers
+    threads
+        number of requests handled concurrently by the worker
+
+    Returns
+    -------
+    int
+        process id of the worker
+    """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(server, sock, threads)
+        finally:
+            os._exit(0)
+    logger.info("Started worker %d", pid)
+    return pid
+
+
+def serve(host: str, port: int, workers: int, threads: int) -> None:
+    """
+    Preload the app, fork the workers and restart them if they die
+
+    Parameters
+    ----------
+    host
+        interface to listen on
+    port
+        port to listen on
+    workers
+        number of worker processes
+    threads
+        number of threads per worker
+
+    Returns
+    ------
+    None
+    """
+    start = time.perf_counter()
+    server = preload()
+    logger.info("Preloaded app and datasets in %.3fs", time.perf_counter() - start)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(BaseWSGIServer.request_queue_size)
+    logger.info(
+        "Serving on http://%s:%d with %d workers x %d threads",
+        host,
+        sock.getsockname()[1],
+        workers,
+        threads,
+    )
+
+    pids = set()
+    started = {}
+    stopping = False
+    # Delay before restarting a worker, doubled while the workers keep dying right
+    # after they start (e.g. a broken deployment) so they are not restarted in a loop
+    backoff = 0.5
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        pid = spawn_worker(server, sock, threads)
+        pids.add(pid)
+        started[pid] = time.monotonic()
+    while pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        pids.discard(pid)
+        if not stopping:
+            lifetime = time.monotonic() - started.pop(pid, 0)
+            backoff = min(2 * backoff, 30) if lifetime < 10 else 0.5
+            logger.warning(
+                "Worker %d exited with code %d, restarting in %.1fs",
+                pid,
+                os.waitstatus_to_exitcode(status),
+                backoff,
+            )
+            time.sleep(backoff)
+            if stopping:
+                continue
+            pid = spawn_worker(server, sock, threads)
+            pids.add(pid)
+            started[pid] = time.monotonic()
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve the dashboard with preloaded data and forked workers"
+    )
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8050)))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("WEB_WORKERS", os.cpu_count() or 1)),
+        help="number of worker processes (WEB_WORKERS, default: number of cores)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=int(os.environ.get("WEB_THREADS", 8)),
+        help="number of threads per worker (WEB_THREADS, default: 8)",
+    )
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.threads)
+    sys.exit(0)
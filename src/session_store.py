@@ -0,0 +1,422 @@
+import os
+import pickle
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha1
+from typing import Dict, Optional, Tuple
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict stored on the server, the cookie only holds its random id"""
+
+    # A plain attribute rather than the "_permanent" key of SessionMixin, so that it
+    # does not make empty sessions worth storing
+    permanent = True
+
+    def __init__(
+        self,
+        initial: Optional[Dict] = None,
+        sid: str = None,
+        new: bool = False,
+        expiry: float = 0.0,
+        permanent: bool = True,
+    ) -> None:
+        def on_update(self):
+            self.modified = True
+
+        super(ServerSideSession, self).__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expiry = expiry
+        self.permanent = permanent
+        self.modified = False
+
+
+class SqliteSessionBackend:
+    """Session storage shared by all workers of a host in a SQLite database in WAL mode"""
+
+    def __init__(self, path: str) -> None:
+        """
+        Create the database and sessions table if needed
+
+        Parameters
+        ----------
+        path
+            file name of the SQLite database, its folder is created if missing
+
+        Returns
+        ------
+        None
+        """
+        self.path = path
+        self.local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = self.connection()
+        # WAL lets readers proceed while another worker writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions "
+            "(id TEXT PRIMARY KEY, version INTEGER, expiry REAL, data BLOB)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expiry)"
+        )
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Connection of the current thread, reopened after a fork
+
+        Returns
+        -------
+        sqlite3.Connection
+            autocommit connection which is only used by the calling thread
+        """
+        if getattr(self.local, "pid", None) != os.getpid():
+            self.local.pid = os.getpid()
+            self.local.connection = sqlite3.connect(
+                self.path, timeout=10, isolation_level=None
+            )
+            self.local.connection.execute("PRAGMA synchronous=NORMAL")
+        return self.local.connection
+
+    def version(self, sid: str, now: float) -> Optional[Tuple[int, float]]:
+        """
+        Lookup the version and expiry of a stored session without reading its data
+
+        Parameters
+        ----------
+        sid
+            session id
+        now
+            current time, expired sessions are treated as missing
+
+        Returns
+        -------
+        Optional[Tuple[int, float]]
+            version and expiry of the session, or None if it does not exist
+        """
+        return (
+            self.connection()
+            .execute(
+                "SELECT version, expiry FROM sessions WHERE id = ? AND expiry > ?",
+                (sid, now),
+            )
+            .fetchone()
+        )
+
+    def load(self, sid: str, now: float) -> Optional[Tuple[int, float, bytes]]:
+        """
+        Read a stored session
+
+        Parameters
+        ----------
+        sid
+            session id
+        now
+            current time, expired sessions are treated as missing
+
+        Returns
+        -------
+        Optional[Tuple[int, float, bytes]]
+            version, expiry and pickled data of the session, or None if it does not exist
+        """
+        return (
+            self.connection()
+            .execute(
+                "SELECT version, expiry, data FROM sessions WHERE id = ? AND expiry > ?",
+                (sid, now),
+            )
+            .fetchone()
+        )
+
+    def save(self, sid: str, data: bytes, expiry: float) -> int:
+        """
+        Insert or replace a session
+
+        Parameters
+        ----------
+        sid
+            session id
+        data
+            pickled session data
+        expiry
+            time after which the session is discarded
+
+        Returns
+        -------
+        int
+            new version of the session
+        """
+        # Random versions need no read back and cannot collide between workers
+        version = secrets.randbits(62)
+        self.connection().execute(
+            "INSERT OR REPLACE INTO sessions (id, version, expiry, data) "
+            "VALUES (?, ?, ?, ?)",
+            (sid, version, expiry, data),
+        )
+        return version
+
+    def touch(self, sid: str, expiry: float) -> None:
+        """
+        Extend the expiry of a session without rewriting its data
+
+        Parameters
+        ----------
+        sid
+            session id
+        expiry
+            new time after which the session is discarded
+
+        Returns
+        ------
+        None
+        """
+        self.connection().execute(
+            "UPDATE sessions SET expiry = ? WHERE id = ?", (expiry, sid)
+        )
+
+    def delete(self, sid: str) -> None:
+        """
+        Remove a session
+
+        Parameters
+        ----------
+        sid
+            session id
+
+        Returns
+        ------
+        None
+        """
+        self.connection().execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def purge_expired(self, now: float) -> int:
+        """
+        Remove all expired sessions in a single statement
+
+        Parameters
+        ----------
+        now
+            current time
+
+        Returns
+        -------
+        int
+            number of sessions removed
+        """
+        return (
+            self.connection()
+            .execute("DELETE FROM sessions WHERE expiry <= ?", (now,))
+            .rowcount
+        )
+
+
+class CachedSessionInterface(SessionInterface):
+    """
+    Server-side sessions with an in-process LRU in front of a shared backend.
+    Sessions are only written when their content changed (or to extend the expiry
+    once half of the lifetime has passed), and expired sessions are purged in bulk
+    at most once per cleanup interval.
+    """
+
+    def __init__(
+        self,
+        backend,
+        lru_size: int = 1024,
+        cleanup_interval: float = 300,
+        permanent: bool = True,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        backend
+            shared session storage, e.g. SqliteSessionBackend
+        lru_size
+            number of pickled sessions kept in process memory
+        cleanup_interval
+            seconds between two purges of expired sessions
+        permanent
+            whether the cookie expires after PERMANENT_SESSION_LIFETIME, like the
+            flask-session default, rather than when the browser is closed
+
+        Returns
+        ------
+        None
+        """
+        self.backend = backend
+        self.lru_size = lru_size
+        self.cleanup_interval = cleanup_interval
+        self.permanent = permanent
+        self.cache = OrderedDict()  # sid -> (version, digest, pickled data)
+        self.lock = threading.Lock()
+        self.last_cleanup = 0.0
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "CachedSessionInterface":
+        """
+        Build the interface from the SESSION_* values of the flask config
+
+        Parameters
+        ----------
+        config
+            flask app config
+
+        Returns
+        -------
+        CachedSessionInterface
+            interface backed by the SQLite database at SESSION_SQLITE_PATH
+        """
+        return cls(
+            SqliteSessionBackend(config.get("SESSION_SQLITE_PATH", "flask_session.db")),
+            lru_size=config.get("SESSION_LRU_SIZE", 1024),
+            cleanup_interval=config.get("SESSION_CLEANUP_INTERVAL", 300),
+            permanent=config.get("SESSION_PERMANENT", True),
+        )
+
+    def open_session(self, app, request) -> ServerSideSession:
+        sid = request.cookies.get(app.session_cookie_name)
+        if not sid:
+            return self.new_session()
+
+        now = time.time()
+        with self.lock:
+            cached = self.cache.get(sid)
+        if cached is not None:
+            stored = self.backend.version(sid, now)
+            if stored is not None and stored[0] == cached[0]:
+                # Unchanged by any other worker, skip reading the data. It is unpickled
+                # again so that in place changes to nested values cannot alter the cache
+                with self.lock:
+                    self.cache.move_to_end(sid)
+                data = pickle.loads(cached[2])
+                return ServerSideSession(
+                    data, sid=sid, expiry=stored[1], permanent=self.permanent
+                )
+
+        stored = self.backend.load(sid, now)
+        if stored is None:
+            return self.new_session()
+        version, expiry, blob = stored
+        self.remember(sid, version, sha1(blob).digest(), blob)
+        return ServerSideSession(
+            pickle.loads(blob), sid=sid, expiry=expiry, permanent=self.permanent
+        )
+
+    def new_session(self) -> ServerSideSession:
+        """
+        Start an empty session with a new random id
+
+        Returns
+        -------
+        ServerSideSession
+            the session, which is only stored once something is put in it
+        """
+        return ServerSideSession(
+            sid=secrets.token_urlsafe(32), new=True, permanent=self.permanent
+        )
+
+    def save_session(self, app, session: ServerSideSession, response) -> None:
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+        self.purge_expired(now)
+
+        if not session:
+            if session.modified:
+                self.forget(session.sid)
+                self.backend.delete(session.sid)
+                response.delete_cookie(
+                    app.session_cookie_name, domain=domain, path=path
+                )
+            return
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        if not session.modified and not session.new:
+            if session.expiry - now < lifetime / 2:
+                self.backend.touch(session.sid, now + lifetime)
+        else:
+            blob = pickle.dumps(dict(session))
+            digest = sha1(blob).digest()
+            with self.lock:
+                cached = self.cache.get(session.sid)
+            if cached is None or cached[1] != digest:
+                version = self.backend.save(session.sid, blob, now + lifetime)
+                self.remember(session.sid, version, digest, blob)
+            elif session.expiry - now < lifetime / 2:
+                self.backend.touch(session.sid, now + lifetime)
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                app.session_cookie_name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def remember(self, sid: str, version: int, digest: bytes, blob: bytes) -> None:
+        """
+        Put a session in the LRU, evicting the least recently used beyond lru_size
+
+        Parameters
+        ----------
+        sid
+            session id
+        version
+            stored version of the session
+        digest
+            hash of the pickled data, used to detect unchanged sessions
+        blob
+            pickled session data
+
+        Returns
+        ------
+        None
+        """
+        with self.lock:
+            self.cache[sid] = (version, digest, blob)
+            self.cache.move_to_end(sid)
+            while len(self.cache) > self.lru_size:
+                self.cache.popitem(last=False)
+
+    def forget(self, sid: str) -> None:
+        """
+        Remove a session from the LRU
+
+        Parameters
+        ----------
+        sid
+            session id
+
+        Returns
+        ------
+        None
+        """
+        with self.lock:
+            self.cache.pop(sid, None)
+
+    def purge_expired(self, now: float) -> None:
+        """
+        Remove expired sessions from the backend once per cleanup interval
+
+        Parameters
+        ----------
+        now
+            current time
+
+        Returns
+        ------
+        None
+        """
+        if now - self.last_cleanup < self.cleanup_interval:
+            return
+        self.last_cleanup = now
+        self.backend.purge_expired(now)
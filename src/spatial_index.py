@@ -0,0 +1,244 @@
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+
+class GridIndex:
+    """
+    Pyramid of uniform grids over longitude/latitude with pre-aggregated per-cell stats.
+    Level z splits the bounding box into 2**z by 2**z cells, every level is derived
+    from the finest one so a viewport query only touches its visible cells.
+    """
+
+    def __init__(
+        self,
+        longitude: np.ndarray,
+        latitude: np.ndarray,
+        values: np.ndarray,
+        levels: int = 9,
+    ) -> None:
+        """
+        Assign the points to the cells of the finest grid and aggregate all the levels
+
+        Parameters
+        ----------
+        longitude
+            longitude of every point
+        latitude
+            latitude of every point
+        values
+            value aggregated per cell, e.g. the median house value of every point
+        levels
+            number of levels, the finest has 2**(levels-1) cells per side
+
+        Returns
+        ------
+        None
+        """
+        self.levels = levels
+        self.size = 2 ** (levels - 1)
+        longitude = np.asarray(longitude, dtype=np.float64)
+        latitude = np.asarray(latitude, dtype=np.float64)
+        # Pad the bounds a little so the maximum falls inside the last cell
+        pad_x = (longitude.max() - longitude.min()) * 1e-6 or 1e-6
+        pad_y = (latitude.max() - latitude.min()) * 1e-6 or 1e-6
+        self.bounds = (
+            longitude.min() - pad_x,
+            longitude.max() + pad_x,
+            latitude.min() - pad_y,
+            latitude.max() + pad_y,
+        )
+        # Cell of every point, in chunks which are concatenated when next aggregated
+        self.cells = [self.cell_ids(longitude, latitude)]
+        self.count = self.aggregate(np.ones(len(self.cells[0])))
+        self.value_sum = self.aggregate(values)
+
+    def cell_ids(self, longitude: np.ndarray, latitude: np.ndarray) -> np.ndarray:
+        """
+        Find the cell of the finest grid of every point, points outside are clipped
+
+        Parameters
+        ----------
+        longitude
+            longitude of every point
+        latitude
+            latitude of every point
+
+        Returns
+        -------
+        np.ndarray
+            flat cell index (row * size + column) of every point
+        """
+        min_x, max_x, min_y, max_y = self.bounds
+        column = (longitude - min_x) / (max_x - min_x) * self.size
+        row = (latitude - min_y) / (max_y - min_y) * self.size
+        column = np.clip(column.astype(np.int64), 0, self.size - 1)
+        row = np.clip(row.astype(np.int64), 0, self.size - 1)
+        return (row * self.size + column).astype(np.int32)
+
+    def aggregate(self, weights: np.ndarray, cells: Optional[np.ndarray] = None):
+        """
+        Sum weights per cell on every level of the pyramid
+
+        Parameters
+        ----------
+        weights
+            value of every point to sum
+        cells
+            finest cell of every point, the indexed points if None
+
+        Returns
+        -------
+        List[np.ndarray]
+            one 2D array of sums per level, from the coarsest (1 cell) to the finest
+        """
+        if cells is None:
+            if len(self.cells) > 1:
+                self.cells = [np.concatenate(self.cells)]
+            cells = self.cells[0]
+        finest = np.bincount(
+            cells,
+            weights=np.asarray(weights, dtype=np.float64),
+            minlength=self.size**2,
+        ).reshape(self.size, self.size)
+        pyramid = [finest]
+        for _ in range(self.levels - 1):
+            grid = pyramid[0]
+            half = grid.shape[0] // 2
+            # Each cell of a coarser level is the sum of a 2x2 block of the finer one
+            pyramid.insert(0, grid.reshape(half, 2, half, 2).sum(axis=(1, 3)))
+        return pyramid
+
+    def add_points(
+        self, longitude: np.ndarray, latitude: np.ndarray, values: np.ndarray
+    ) -> None:
+        """
+        Index more points, only their cells are aggregated and added to the existing
+        sums. The bounds are kept, points outside of them count in the border cells.
+
+        Parameters
+        ----------
+        longitude
+            longitude of every new point
+        latitude
+            latitude of every new point
+        values
+            value of every new point
+
+        Returns
+        ------
+        None
+        """
+        cells = self.cell_ids(
+            np.asarray(longitude, dtype=np.float64),
+            np.asarray(latitude, dtype=np.float64),
+        )
+        count = self.aggregate(np.ones(len(cells)), cells)
+        value_sum = self.aggregate(values, cells)
+        # New arrays rather than in place sums, so concurrent queries see either state
+        self.cells = self.cells + [cells]
+        self.count = [a + b for a, b in zip(self.count, count)]
+        self.value_sum = [a + b for a, b in zip(self.value_sum, value_sum)]
+
+    def level_for(
+        self, x_range: Tuple[float, float], y_range: Tuple[float, float], cells: int
+    ) -> int:
+        """
+        Choose the finest level which shows at most a number of cells across a viewport
+
+        Parameters
+        ----------
+        x_range
+            visible longitude range
+        y_range
+            visible latitude range
+        cells
+            maximum number of cells along either axis of the viewport
+
+        Returns
+        -------
+        int
+            level of the pyramid
+        """
+        min_x, max_x, min_y, max_y = self.bounds
+        fraction = max(
+            (x_range[1] - x_range[0]) / (max_x - min_x),
+            (y_range[1] - y_range[0]) / (max_y - min_y),
+        )
+        level = int(np.floor(np.log2(cells / max(fraction, 1e-12))))
+        return int(np.clip(level, 0, self.levels - 1))
+
+    def query(
+        self,
+        x_range: Optional[Tuple[float, float]] = None,
+        y_range: Optional[Tuple[float, float]] = None,
+        cells: int = 64,
+        residual_sum: Optional[List[np.ndarray]] = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Per-cell stats of the cells visible in a viewport, at a level matching its zoom
+
+        Parameters
+        ----------
+        x_range
+            visible longitude range, the whole index if None
+        y_range
+            visible latitude range, the whole index if None
+        cells
+            maximum number of cells along either axis of the viewport
+        residual_sum
+            residuals of a fitted model aggregated with aggregate(), they are kept out
+            of the index as every user can fit a different model
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+            "x" and "y" cell centers, and "count", "value" (mean value) and "residual"
+            (mean residual, all missing without residual_sum) as 2D arrays with one
+            row per y and missing values for the empty cells
+        """
+        min_x, max_x, min_y, max_y = self.bounds
+        x_range = x_range or (min_x, max_x)
+        y_range = y_range or (min_y, max_y)
+        level = self.level_for(x_range, y_range, cells)
+        size = 2**level
+        width = (max_x - min_x) / size
+        height = (max_y - min_y) / size
+        x0, x1 = np.clip(
+            [int((x_range[0] - min_x) // width), int((x_range[1] - min_x) // width)],
+            0,
+            size - 1,
+        )
+        y0, y1 = np.clip(
+            [int((y_range[0] - min_y) // height), int((y_range[1] - min_y) // height)],
+            0,
+            size - 1,
+        )
+        window = (slice(y0, y1 + 1), slice(x0, x1 + 1))
+
+        count = self.count[level][window]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            divisor = np.where(count > 0, count, np.nan)
+            value = self.value_sum[level][window] / divisor
+            if residual_sum is None:
+                residual = np.full(count.shape, np.nan)
+            else:
+                residual = residual_sum[level][window] / divisor
+        return {
+            "x": min_x + (np.arange(x0, x1 + 1) + 0.5) * width,
+            "y": min_y + (np.arange(y0, y1 + 1) + 0.5) * height,
+            "count": divisor,
+            "value": value,
+            "residual": residual,
+        }
+
+    def memory_usage(self) -> int:
+        """
+        Memory used by the cell ids and the aggregates
+
+        Returns
+        -------
+        int
+            memory in bytes
+        """
+        grids = self.count + self.value_sum
+        return int(sum(array.nbytes for array in self.cells + grids))
@@ -1,11 +1,13 @@
 from functools import wraps
 from flask import session, redirect, url_for
 from azure_ad import app_config
+import os
 import yaml
 
 
 def get_config():
-    with open("src/config/config.yaml") as fp:
+    # APP_CONFIG points to another config file, e.g. the one written by load_test.py
+    with open(os.environ.get("APP_CONFIG", "src/config/config.yaml")) as fp:
         return yaml.safe_load(fp)
 
 
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The app modules import each other by their top level names (e.g. `from model import
+# Model`) since the app is started from the src folder, so make those importable too
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
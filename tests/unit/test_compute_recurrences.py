@@ -0,0 +1,112 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import pytest
+from src.compute_recurrences import evaluate, run_batch, write_records
+
+FIBONACCI = {"offsets": [-1, -2], "coefficients": [1, 1], "seed": [1, 1]}
+
+
+@pytest.mark.batch_tests
+def test_evaluate():
+    record = evaluate(dict(FIBONACCI, id="fib", indices=[10, 3], range=[0, 6, 2]))
+    assert record == {
+        "id": "fib",
+        "indices": [10, 3, 0, 2, 4],
+        "values": [89, 3, 1, 2, 5],
+    }
+
+
+@pytest.mark.batch_tests
+def test_evaluate_deep_index():
+    # Far beyond the recursion limit if the memo were filled top down
+    record = evaluate(dict(FIBONACCI, indices=[20000]))
+    assert len(str(record["values"][0])) == 4180
+
+
+@pytest.mark.batch_tests
+@pytest.mark.parametrize(
+    "change, error",
+    [
+        ({"offsets": [-1]}, "mismatching"),
+        ({"offsets": [-1, 2]}, "negative"),
+        ({"seed": [1]}, "seed"),
+        ({"indices": [-1]}, "indices"),
+        ({"coefficients": None}, "TypeError"),
+    ],
+)
+def test_evaluate_errors(change, error):
+    definition = dict(FIBONACCI, id=7, indices=[3])
+    definition.update(change)
+    record = evaluate(definition)
+    assert record["id"] == 7 and error in record["error"]
+
+
+@pytest.mark.batch_tests
+@pytest.mark.parametrize("ordered", [True, False])
+def test_run_batch(ordered):
+    lines = [json.dumps(dict(FIBONACCI, id=n, indices=[n])) for n in range(20)]
+    lines[5] = "not json"
+    lines.insert(3, "")
+    records = list(run_batch(lines, workers=2, window=3, ordered=ordered))
+    assert len(records) == 20
+    if ordered:
+        assert [r["line"] for r in records] == [n for n in range(1, 22) if n != 4]
+    by_id = {r["id"]: r for r in records if "error" not in r}
+    assert by_id[10]["values"] == [89]
+    assert [r["line"] for r in records if "error" in r] == [7]
+
+    output = io.StringIO()
+    assert write_records(records, output) == 1
+    assert [json.loads(line) for line in output.getvalue().splitlines()] == records
+
+
+@pytest.mark.modular_tests
+def test_evaluate_modulus():
+    record = evaluate(dict(FIBONACCI, modulus=10, indices=[10, 60 * 10**30 + 10]))
+    assert record["values"] == [9, 9]
+
+
+@pytest.mark.batch_tests
+@pytest.mark.parametrize("option", ["--window=0", "--workers=0"])
+def test_batch_rejects_empty_pool(option):
+    result = subprocess.run(
+        [sys.executable, "src/compute_recurrences.py", "batch", option],
+        input="",
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 2
+    assert "must be at least 1" in result.stderr
+
+
+@pytest.mark.batch_tests
+def test_evaluate_limits():
+    too_many = evaluate(dict(FIBONACCI, range=[0, 10**9]), max_values=100)
+    assert "more than 100 values" in too_many["error"]
+    too_deep = evaluate(dict(FIBONACCI, indices=[10**9]), max_index=1000)
+    assert "need a modulus" in too_deep["error"]
+    # Fibonacci residues repeat every 120 modulo 11 but every 1500 modulo 1000
+    modular = dict(FIBONACCI, modulus=11, indices=[10**9])
+    assert "values" in evaluate(modular, max_index=1000)
+    modular["modulus"] = 1000
+    assert "do not repeat" in evaluate(modular, max_index=1000)["error"]
+
+
+def crash_on_three(definition, *limits):
+    if definition["id"] == 3:
+        os._exit(1)  # as when killed for using too much memory
+    return evaluate(definition, *limits)
+
+
+@pytest.mark.batch_tests
+def test_run_batch_worker_died(monkeypatch):
+    monkeypatch.setattr("src.compute_recurrences.evaluate", crash_on_three)
+    lines = [json.dumps(dict(FIBONACCI, id=n, indices=[n])) for n in range(8)]
+    records = list(run_batch(lines, workers=1, window=1))
+    assert [r["line"] for r in records] == list(range(1, 9))
+    assert "BrokenProcessPool" in records[3]["error"]
+    # A new pool evaluates the following definitions
+    assert records[7]["values"] == [21]
@@ -0,0 +1,82 @@
+import pytest
+from src.dataset_registry import DatasetRegistry
+
+
+class FakeModel:
+    """Stands in for Model so the registry can be tested without loading data"""
+
+    def __init__(self, data_csv):
+        self.data_csv = data_csv
+        self.appended = 0
+
+    def memory_usage(self):
+        return 400 * 1024 + self.appended
+
+    def refresh(self):
+        if self.data_csv == "east.csv":
+            raise OSError("east.csv is gone")
+        # Every refresh appends 300KB of rows
+        self.appended += 300 * 1024
+        return 10
+
+
+loaded = []
+
+
+def fake_factory(data_csv):
+    loaded.append(data_csv)
+    return FakeModel(data_csv)
+
+
+@pytest.fixture
+def registry():
+    loaded.clear()
+    sources = {"north": "north.csv", "south": "south.csv", "east": "east.csv"}
+    # Room for two of the 400KB fake models
+    return DatasetRegistry(sources, max_memory_mb=1, model_factory=fake_factory)
+
+
+@pytest.mark.registry_tests
+def test_registry_loads_once(registry):
+    assert registry.get("south").data_csv == "south.csv"
+    assert registry.get("south") is registry.get("south")
+    assert registry.get().data_csv == "north.csv"  # first source is the default
+    assert loaded == ["south.csv", "north.csv"]
+
+
+@pytest.mark.registry_tests
+def test_registry_evicts_least_recently_used(registry):
+    registry.get("north")
+    registry.get("south")
+    registry.get("north")  # south is now the least recently used
+    registry.get("east")
+    assert list(registry.models) == ["north", "east"]
+    registry.get("south")
+    assert loaded == ["north.csv", "south.csv", "east.csv", "south.csv"]
+
+
+@pytest.mark.registry_tests
+def test_registry_unknown_dataset(registry):
+    with pytest.raises(KeyError):
+        registry.get("west")
+
+
+@pytest.mark.registry_tests
+def test_registry_refresh(registry):
+    registry.get("east")
+    registry.get("south")
+    # The failing dataset is logged and skipped, the other one grows over the cap
+    # which evicts the least recently used dataset
+    assert registry.refresh() == {"south": 10}
+    assert list(registry.models) == ["south"]
+    assert registry.start_watcher() is None  # no refresh interval configured
+
+
+@pytest.mark.registry_tests
+def test_registry_preload(registry):
+    registry.default = "south"
+    # The default is loaded first, then the others until the cap is reached, the
+    # model which does not fit is dropped instead of evicting a preloaded one
+    assert registry.preload() == ["north", "south"]
+    assert loaded == ["south.csv", "north.csv", "east.csv"]
+    assert registry.memory_usage() <= registry.max_memory_bytes
@@ -1,6 +1,6 @@
 import math
 import pytest
-from src.recurrence_calculators import FibonacciCalculator
+from src.recurrence_calculators import FibonacciCalculator, RecurrenceCalculator
 
 
 # Helper function local to these tests computes approximate fibonacci formula
@@ -39,3 +39,52 @@ def test_reset_fibonacci_seed():
     assert fc.count() == 6
     assert fc.compute(10) == 225
     assert fc.count() == 11
+
+
+@pytest.mark.modular_tests
+@pytest.mark.parametrize("modulus, period", [(2, 3), (10, 60), (100, 300), (1, 1)])
+def test_pisano_period(modulus, period):
+    fc = FibonacciCalculator(modulus)
+    assert fc.cycle() == (0, period)
+    # Only one period of residues is kept
+    assert fc.count() == period
+    exact = FibonacciCalculator()
+    assert all(fc.compute(n) == exact.compute(n) % modulus for n in range(500))
+
+
+@pytest.mark.modular_tests
+def test_modular_huge_index():
+    fc = FibonacciCalculator(10)
+    # Indices a multiple of the Pisano period 60 apart have the same last digit
+    assert fc.compute(60 * 10**100 + 10) == fc.compute(10) == 9
+    assert fc.compute(60 * 10**100 - 1) == fc.compute(59) == 0
+    assert fc.count() == 60
+
+
+@pytest.mark.modular_tests
+def test_modular_preperiod():
+    # r[n] = 2*r[n-2] mod 8 reaches 0 and stays there
+    rc = RecurrenceCalculator([-2], [2], [3, 1], modulus=8)
+    assert rc.cycle() == (6, 1)
+    assert [rc.compute(n) for n in range(8)] == [3, 1, 6, 2, 4, 4, 0, 0]
+    assert rc.compute(10**50) == 0
+
+
+@pytest.mark.modular_tests
+def test_modular_reset_fibonacci_seed():
+    fc = FibonacciCalculator(1000)
+    fc.compute(10**9)
+    fc.reset_start([1, 3, 4, 7, 13, 20])
+    assert fc.count() == 6
+    assert fc.compute(10) == 225
+    assert fc.count() == 11
+
+
+@pytest.mark.modular_tests
+@pytest.mark.parametrize(
+    "offsets, coefficients, modulus",
+    [([-1], [0.5], 7), ([1], [1], 7), ([-1], [1], 0), ([-1], [1], 7.0)],
+)
+def test_modular_invalid_definition(offsets, coefficients, modulus):
+    with pytest.raises(ValueError):
+        RecurrenceCalculator(offsets, coefficients, [1], modulus=modulus)
@@ -0,0 +1,76 @@
+from urllib.parse import parse_qs, urlparse
+import msal
+import pytest
+import requests
+from src.load_test import (
+    AUTHORITY_HOST,
+    CLIENT_ID,
+    TENANT,
+    AuthorityClient,
+    LatencyRecorder,
+    StubAuthority,
+    find_value,
+)
+
+
+@pytest.fixture
+def authority():
+    authority = StubAuthority()
+    authority.start()
+    yield authority
+    authority.stop()
+
+
+@pytest.mark.load_tests
+def test_stub_authority_login(authority):
+    msal_app = msal.ConfidentialClientApplication(
+        CLIENT_ID,
+        authority="%s/%s" % (AUTHORITY_HOST, TENANT),
+        client_credential="secret",
+        http_client=AuthorityClient(authority.url),
+    )
+    flow = msal_app.initiate_auth_code_flow(
+        ["User.Read"], redirect_uri="http://localhost/retrieveToken"
+    )
+    response = requests.get(
+        flow["auth_uri"] + "&login_hint=ada@loadtest", allow_redirects=False
+    )
+    callback = urlparse(response.headers["Location"])
+    assert callback.path == "/retrieveToken"
+
+    auth_response = {k: v[0] for k, v in parse_qs(callback.query).items()}
+    result = msal_app.acquire_token_by_auth_code_flow(flow, auth_response)
+    assert result["id_token_claims"]["preferred_username"] == "ada@loadtest"
+
+    # Codes are single use
+    result = msal_app.acquire_token_by_auth_code_flow(flow, auth_response)
+    assert result["error"] == "invalid_grant"
+
+
+@pytest.mark.load_tests
+def test_latency_recorder():
+    recorder = LatencyRecorder()
+    for ms in range(1, 101):
+        recorder.record("GET /a", ms / 1000)
+    recorder.record("GET /b", 1.0, ok=False)
+    rows = {row["endpoint"]: row for row in recorder.summary(elapsed=10)}
+    assert rows["GET /a"]["requests"] == 100
+    assert rows["GET /a"]["throughput"] == pytest.approx(10)
+    assert rows["GET /a"]["p50_ms"] == pytest.approx(50.5)
+    assert rows["GET /a"]["p99_ms"] == pytest.approx(99.01)
+    assert rows["GET /b"]["errors"] == 1
+    assert rows["all"]["requests"] == 101 and rows["all"]["errors"] == 1
+
+
+@pytest.mark.load_tests
+def test_find_value():
+    layout = {
+        "props": {
+            "children": [
+                {"props": {"id": "banner"}},
+                {"props": {"children": {"props": {"id": "dataset", "value": "x"}}}},
+            ]
+        }
+    }
+    assert find_value(layout, "dataset") == "x"
+    assert find_value(layout, "missing") is None
@@ -1,5 +1,11 @@
+import subprocess
+import sys
+import threading
+import time
 import pytest
+import numpy as np
 import pandas as pd
+from src.dataset_registry import DatasetRegistry
 from src.model import Model
 
 # Make a new Model object without running __init__
@@ -144,7 +150,8 @@ def test_prepare_missing_column(small_real_dataframe, drop_column):
 
 @pytest.mark.fitting_tests
 @pytest.mark.parametrize(
-    "algorithm", ["Linear Regression", "Decision Tree", "Random Forest"]
+    "algorithm",
+    ["Linear Regression", "Decision Tree", "Random Forest", "Gradient Boosting"],
 )
 def test_fit_model(simple_dataframe, algorithm):
     # Load the real data because we need it to fit realistic models
@@ -174,3 +181,267 @@ def test_fit_model(simple_dataframe, algorithm):
         assert pytest.approx(simple_predictions[0]) == 216567.87919463086
     elif algorithm == "Random Forest":
         assert pytest.approx(simple_predictions[0]) == 195129.02
+    elif algorithm == "Gradient Boosting":
+        # Early stopping ends training before all the iterations are used
+        assert test_model.model.n_iter_ < test_model.model.max_iter
+
+
+@pytest.mark.fitting_tests
+def test_estimators_imported_lazily():
+    # Importing the model module should not pay for the sklearn estimator imports
+    code = (
+        "import sys; sys.path.insert(0, 'src'); import model; "
+        "assert not any(m.startswith('sklearn') for m in sys.modules)"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+@pytest.mark.fitting_tests
+def test_fit_model_threads(monkeypatch):
+    from threadpoolctl import threadpool_info
+    from sklearn.ensemble import HistGradientBoostingRegressor
+
+    def openmp_threads():
+        return [
+            i["num_threads"] for i in threadpool_info() if i["user_api"] == "openmp"
+        ]
+
+    before = openmp_threads()
+    during = []
+    fit = HistGradientBoostingRegressor.fit
+
+    def recording_fit(self, *args, **kwargs):
+        during.append(openmp_threads())
+        time.sleep(0.1)  # so that the fits overlap
+        return fit(self, *args, **kwargs)
+
+    monkeypatch.setattr(HistGradientBoostingRegressor, "fit", recording_fit)
+    # A limit other than the default, to see it applied
+    limit = max(before, default=1) + 1
+    model = Model(data_file_location, n_threads=limit)
+    # Overlapping fits each run with the configured limit, and the process is left
+    # with its own limit once they are done
+    fits = [
+        threading.Thread(
+            target=model.fit_model, args=("Gradient Boosting", ["median_income"])
+        )
+        for _ in range(3)
+    ]
+    for thread in fits:
+        thread.start()
+    for thread in fits:
+        thread.join()
+    assert during == [[limit] * len(before)] * 3
+    assert openmp_threads() == before
+
+
+@pytest.mark.fitting_tests
+def test_training_threads_config():
+    config = {"datasets": {"sources": {"housing": "x.csv"}, "training_threads": 3}}
+    registry = DatasetRegistry.from_config(config)
+    assert registry.model_factory.keywords["n_threads"] == 3
+
+
+@pytest.mark.fitting_tests
+def test_encodings_cached():
+    test_model.__init__(data_file_location)
+    memory = test_model.memory_usage()
+    encoded = test_model.encode_features(["total_rooms", "ocean_proximity"])
+    assert test_model.encode_features(["total_rooms", "ocean_proximity"]) is encoded
+    assert "ocean_proximity_INLAND" in encoded.columns
+    assert test_model.memory_usage() > memory  # the cached encoding is accounted for
+
+
+@pytest.mark.prepare_tests
+def test_prepare_compact_dtypes():
+    # The full dataset is used so that every ocean_proximity category is present
+    real_dataframe = pd.read_csv(data_file_location)
+    compact_model = object.__new__(Model)
+    compact_model.compact_dtypes = True
+    full_df, values_df, features_df = test_model.prepare_data(real_dataframe.copy())
+    compact_df, compact_values, compact_features = compact_model.prepare_data(
+        real_dataframe.copy()
+    )
+    assert compact_df["ocean_proximity"].dtype == "category"
+    assert compact_df["median_house_value"].dtype == "int32"
+    assert compact_df["longitude"].dtype == "float32"
+    assert compact_df["rooms_per_household"].dtype == "float32"
+    memory = full_df.memory_usage(deep=True).sum()
+    assert compact_df.memory_usage(deep=True).sum() < memory / 2
+    # The summary is unchanged by the compact types
+    assert compact_model.summarize_data(compact_df) == test_model.summarize_data(
+        full_df
+    )
+
+
+@pytest.mark.prepare_tests
+def test_compact_keeps_out_of_range_values():
+    dataframe = pd.DataFrame({"big": [1, 2**40], "fraction": [0.5, 1.0]})
+    compact_df = test_model.compact_data(dataframe)
+    assert compact_df["big"].dtype == "int64"
+    assert compact_df["fraction"].dtype == "float32"
+
+
+@pytest.mark.prepare_tests
+def test_prepare_zero_denominator(simple_dataframe):
+    simple_dataframe.loc[0, "households"] = 0
+    full_df, values_df, features_df = test_model.prepare_data(simple_dataframe)
+    assert pd.isna(full_df.loc[0, "rooms_per_household"])
+    assert pd.isna(full_df.loc[0, "population_per_household"])
+
+
+@pytest.mark.prepare_tests
+@pytest.mark.parametrize("method", ["iqr", "mad"])
+def test_clean_data(small_real_dataframe, method):
+    dataframe = small_real_dataframe.copy()
+    dataframe.loc[0, "median_income"] = 1000.0  # far outside the real range
+    dataframe.loc[1, "total_rooms"] = float("inf")
+    dataframe.loc[2, "median_house_value"] = 500001
+    rules = {
+        "caps": {"median_house_value": 500001},
+        "outliers": {"method": method, "columns": ["median_income"], "threshold": 5},
+    }
+    clean_model = object.__new__(Model)
+    cleaned = clean_model.clean_data(dataframe, rules)
+    assert clean_model.quality_report["non_finite"] == 3  # 2 NaN bedrooms and the inf
+    assert clean_model.quality_report["capped"] >= 1
+    assert clean_model.quality_report["outliers"] >= 1
+    assert len(cleaned) == len(dataframe) - sum(clean_model.quality_report.values())
+    assert 1000.0 not in cleaned["median_income"].values
+    assert cleaned["median_house_value"].max() < 500001
+    assert list(cleaned.index) == list(range(len(cleaned)))
+
+
+@pytest.mark.map_tests
+def test_spatial_index():
+    test_model.__init__(data_file_location)
+    # Fitting does not build the index, the residuals are aggregated once asked for
+    test_model.fit_model("Linear Regression", ["median_income"])
+    assert test_model.grid is None and not test_model.residual_sums
+    assert test_model.residual_sum("Linear Regression", ["median_income"]) is not None
+    assert not test_model.residuals
+    test_model.__init__(data_file_location)
+    grid = test_model.spatial_index()
+    whole = grid.query(cells=1)
+    assert whole["count"].shape == (1, 1)
+    assert whole["count"][0, 0] == len(test_model.data)
+    assert whole["value"][0, 0] == pytest.approx(test_model.values.mean())
+    assert pd.isna(whole["residual"][0, 0])  # no residuals passed
+
+    # Zooming in on the bay area shows finer cells of only that area
+    bay = grid.query((-122.6, -121.8), (37.3, 38.1), cells=16)
+    assert len(bay["x"]) <= 17 and len(bay["y"]) <= 17
+    assert -122.7 < bay["x"].min() and bay["x"].max() < -121.7
+    in_bay = test_model.data["longitude"].between(-122.6, -121.8) & test_model.data[
+        "latitude"
+    ].between(37.3, 38.1)
+    assert pd.Series(bay["count"].ravel()).sum() >= in_bay.sum()
+
+    # Every fitted model keeps its own residuals, so users fitting different models
+    # each see theirs
+    assert test_model.residual_sum("Linear Regression", ["median_income"]) is None
+    for features in [["median_income"], ["median_income", "housing_median_age"]]:
+        values, predictions, r2 = test_model.fit_model("Linear Regression", features)
+        residual_sum = test_model.residual_sum("Linear Regression", features)
+        residual = grid.query(cells=1, residual_sum=residual_sum)["residual"][0, 0]
+        assert residual == pytest.approx((values - predictions).mean(), abs=1e-6)
+    assert len(test_model.residual_sums) == 2
+    first, second = test_model.residual_sums.values()
+    assert not np.allclose(first[-1], second[-1])
+    assert test_model.residual_sum(None, None) is None
+
+
+@pytest.mark.prepare_tests
+def test_append(tmp_path, monkeypatch):
+    raw = pd.read_csv(data_file_location)
+    raw.head(15000).to_csv(tmp_path / "part.csv", index=False)
+    rules = {
+        "caps": {"median_house_value": 500001},
+        "outliers": {"columns": ["median_income"]},
+    }
+    model = Model(str(tmp_path / "part.csv"), compact_dtypes=True, quality_rules=rules)
+    dtypes = model.data.dtypes
+    version = model.data_version
+    model.encode_features(model.features_list)
+    grid = model.spatial_index()
+    model.fit_model("Linear Regression", ["median_income"])
+
+    rows = len(model.data)
+    added = model.append(raw.iloc[15000:])
+    assert 0 < added < len(raw) - 15000  # rows were dropped with the same bounds
+    # The rows are kept as a chunk until the data is used
+    assert len(model.chunks) == 2 and model.row_count() == rows + added
+    assert model.data_version > version
+    version = model.data_version
+    assert (model.data.dtypes == dtypes).all()
+    assert list(model.data.index) == list(range(len(model.data)))
+    assert len(model.values) == len(model.features) == len(model.data)
+    # The derived state matches the one computed from all the rows
+    assert model.summary == model.summarize_data(model.data)
+    encoded = model.encode_features(model.features_list)
+    assert encoded.equals(pd.get_dummies(model.features[model.features_list]))
+    whole = grid.query(cells=1)
+    assert whole["count"][0, 0] == len(model.data)
+    assert whole["value"][0, 0] == pytest.approx(model.values.mean())
+    assert model.residual_sum("Linear Regression", ["median_income"]) is None
+
+    # A new category extends the categorical column and drops the affected encodings
+    typical = raw["median_income"].between(3, 4) & (raw["median_house_value"] < 500001)
+    rows = raw[typical].head(2).assign(ocean_proximity="LAKE")
+    assert model.append(rows) == 2
+    assert "LAKE" in model.data["ocean_proximity"].cat.categories
+    assert tuple(model.features_list) not in model.encodings
+    assert model.data_version > version
+
+    # A failed append leaves the data as it was, without the new category
+    count = len(model.data)
+    rows = raw[typical].head(2).assign(ocean_proximity="RIVER")
+    with monkeypatch.context() as patch:
+        patch.setattr(model, "group_totals", lambda data: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            model.append(rows)
+    assert "RIVER" not in model.data["ocean_proximity"].cat.categories
+    assert len(model.data) == count and model.summary == model.summarize_data(
+        model.data
+    )
+
+
+@pytest.mark.prepare_tests
+def test_refresh(tmp_path):
+    lines = open(data_file_location).read().splitlines(keepends=True)
+    data_csv = tmp_path / "housing.csv"
+    data_csv.write_text("".join(lines[:101]))
+    model = Model(str(data_csv))
+    assert len(model.data) == 100 and model.refresh() == 0
+
+    # The last line is still being written, it is read by the next refresh
+    with open(data_csv, "a") as fp:
+        fp.write("".join(lines[101:111]) + lines[111][:20])
+    assert model.refresh() == 10
+    with open(data_csv, "a") as fp:
+        fp.write(lines[111][20:])
+    assert model.refresh() == 1
+    assert len(model.data) == 111
+    assert (
+        model.data.iloc[-1]["longitude"] == pd.read_csv(data_csv).iloc[-1]["longitude"]
+    )
+
+
+@pytest.mark.prepare_tests
+def test_refresh_failed_append(tmp_path, monkeypatch):
+    lines = open(data_file_location).read().splitlines(keepends=True)
+    data_csv = tmp_path / "housing.csv"
+    data_csv.write_text("".join(lines[:101]))
+    model = Model(str(data_csv))
+    offset = model.source_offset
+
+    # The rows of a failed append are not skipped, the next refresh reads them again
+    with open(data_csv, "a") as fp:
+        fp.write("".join(lines[101:111]))
+    with monkeypatch.context() as patch:
+        patch.setattr(model, "append", lambda rows: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            model.refresh()
+    assert model.source_offset == offset and len(model.data) == 100
+    assert model.refresh() == 10
+    assert model.source_offset == data_csv.stat().st_size
@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+import pytest
+from dash import Dash, html
+from flask import Flask
+from src.profiling import RateLimiter, SamplingProfiler, profile_views
+
+
+def busy_function(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+@pytest.mark.profiling_tests
+def test_sampling_profiler():
+    profiler = SamplingProfiler(threading.get_ident(), interval=0.001)
+    profiler.start()
+    busy_function(0.1)
+    profiler.stop()
+    folded = profiler.folded()
+    assert "busy_function (test_profiling.py" in folded
+    stack, count = folded.splitlines()[0].rsplit(" ", 1)
+    assert int(count) > 0
+
+
+@pytest.mark.profiling_tests
+def test_rate_limiter():
+    limiter = RateLimiter(2)
+    assert limiter.allow() and limiter.allow()
+    assert not limiter.allow()
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {
+        "auth": {"sso": {"enabled": False}},
+        "profiling": {"directory": str(tmp_path), "interval_ms": 1},
+    }
+
+
+def make_client(config):
+    app = Dash(__name__, server=Flask(__name__), routes_pathname_prefix="/home/")
+    app.layout = html.Div()
+
+    @app.server.route("/slow")
+    def slow():
+        busy_function(0.05)
+        return "done"
+
+    return profile_views(app, config).server.test_client()
+
+
+@pytest.mark.profiling_tests
+def test_profile_on_header(config):
+    client = make_client(config)
+    assert client.get("/slow").data == b"done"
+    assert os.listdir(config["profiling"]["directory"]) == []
+    assert client.get("/slow", headers={"X-Profile": "1"}).data == b"done"
+    (profile,) = os.listdir(config["profiling"]["directory"])
+    assert profile.endswith("-slow.folded")
+
+
+@pytest.mark.profiling_tests
+def test_profile_requires_authorized_user(config):
+    config["auth"]["sso"]["enabled"] = True
+    client = make_client(config)
+    client.get("/slow", headers={"X-Profile": "1"})
+    assert os.listdir(config["profiling"]["directory"]) == []
@@ -0,0 +1,54 @@
+import pytest
+from dash import Dash, Input, Output, html
+from flask import Flask
+from src.response_cache import CallbackResponseCache
+
+calls = []
+
+
+@pytest.fixture
+def client():
+    calls.clear()
+    app = Dash(__name__, server=Flask(__name__), routes_pathname_prefix="/home/")
+    app.layout = html.Div([html.Div(id="tab"), html.Div(id="content")])
+
+    @app.callback(Output("content", "children"), [Input("tab", "children")])
+    def render(tab):
+        calls.append(tab)
+        return html.P(tab)
+
+    cache = CallbackResponseCache(
+        "content.children", lambda body: body["inputs"][0]["value"], max_entries=1
+    )
+    return cache.install(app).server.test_client()
+
+
+def request_tab(client, tab):
+    return client.post(
+        "/home/_dash-update-component",
+        json={
+            "output": "content.children",
+            "outputs": {"id": "content", "property": "children"},
+            "inputs": [{"id": "tab", "property": "children", "value": tab}],
+            "changedPropIds": ["tab.children"],
+        },
+    )
+
+
+@pytest.mark.response_cache_tests
+def test_callback_response_cached(client):
+    first = request_tab(client, "a")
+    second = request_tab(client, "a")
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data
+    assert second.mimetype == "application/json"
+    assert "ETag" not in second.headers
+    assert calls == ["a"]  # the callback only ran for the first request
+
+
+@pytest.mark.response_cache_tests
+def test_callback_response_evicted(client):
+    request_tab(client, "a")
+    request_tab(client, "b")  # evicts "a" since only one entry is kept
+    request_tab(client, "a")
+    assert calls == ["a", "b", "a"]
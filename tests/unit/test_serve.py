@@ -0,0 +1,51 @@
+import os
+import re
+import signal
+import subprocess
+import sys
+import pytest
+import requests
+
+
+@pytest.fixture
+def server(tmp_path):
+    env = dict(
+        os.environ,
+        PYTHONPATH="src",
+        SESSION_SQLITE_PATH=str(tmp_path / "sessions.db"),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "src/serve.py", "--host=127.0.0.1", "--port=0"]
+        + ["--workers=2", "--threads=2"],
+        env=env,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    yield process
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+@pytest.mark.serve_tests
+def test_serve_forks_workers_and_stops(server):
+    log = []
+    for line in server.stderr:
+        log.append(line)
+        serving = re.search(r"Serving on (http://\S+) with 2 workers", line)
+        if serving:
+            break
+    else:
+        pytest.fail("".join(log))
+    url = serving.group(1)
+
+    for _ in range(4):
+        response = requests.get(url + "/home/_dash-layout", timeout=30)
+        assert response.status_code == 200
+        assert "tabs-controller" in response.text
+
+    server.send_signal(signal.SIGTERM)
+    assert server.wait(timeout=30) == 0
+    log.extend(server.stderr)
+    assert len([line for line in log if "Started worker" in line]) == 2
+    assert not any("restarting" in line for line in log)
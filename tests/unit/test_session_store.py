@@ -0,0 +1,132 @@
+import pytest
+from flask import Flask, session
+from src.session_store import CachedSessionInterface, SqliteSessionBackend
+
+
+class CountingBackend(SqliteSessionBackend):
+    """Counts the writes and full reads hitting the database"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.saves = 0
+        self.loads = 0
+
+    def save(self, sid, data, expiry):
+        self.saves += 1
+        return super().save(sid, data, expiry)
+
+    def load(self, sid, now):
+        self.loads += 1
+        return super().load(sid, now)
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return CountingBackend(str(tmp_path / "sessions.db"))
+
+
+def make_client(backend):
+    app = Flask(__name__)
+    app.session_interface = CachedSessionInterface(backend)
+
+    @app.route("/set/<value>")
+    def set_value(value):
+        session["value"] = value
+        return "ok"
+
+    @app.route("/get")
+    def get_value():
+        return session.get("value", "")
+
+    @app.route("/append/<value>")
+    def append_value(value):
+        # Changes a nested value in place, which flask does not mark as modified
+        session.setdefault("values", []).append(value)
+        return ",".join(session["values"])
+
+    @app.route("/clear")
+    def clear():
+        session.clear()
+        return "ok"
+
+    return app.test_client()
+
+
+@pytest.mark.session_tests
+def test_session_round_trip(backend):
+    client = make_client(backend)
+    client.get("/set/a")
+    assert client.get("/get").data == b"a"
+    assert backend.saves == 1
+    assert backend.loads == 0  # served from the in-process LRU
+
+
+@pytest.mark.session_tests
+def test_session_written_only_when_changed(backend):
+    client = make_client(backend)
+    client.get("/set/a")
+    client.get("/set/a")  # modified but identical content
+    client.get("/get")
+    assert backend.saves == 1
+    client.get("/set/b")
+    assert backend.saves == 2
+
+
+@pytest.mark.session_tests
+def test_session_shared_between_workers(backend):
+    client = make_client(backend)
+    cookie = client.get("/set/a").headers["Set-Cookie"]
+    sid = cookie.split(";")[0].split("=", 1)[1]
+    # A second interface stands in for another worker process with its own LRU
+    other = make_client(backend)
+    other.set_cookie("localhost", "session", sid)
+    other.get("/set/b")
+    assert backend.loads == 1  # the other worker had to read the session once
+    assert client.get("/get").data == b"b"  # version changed, so the data is reloaded
+    assert backend.loads == 2
+
+
+@pytest.mark.session_tests
+def test_session_cleared(backend):
+    client = make_client(backend)
+    client.get("/set/a")
+    client.get("/clear")
+    assert client.get("/get").data == b""
+    assert (
+        backend.connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 0
+    )
+
+
+@pytest.mark.session_tests
+def test_purge_expired(backend):
+    backend.save("old", b"", expiry=10.0)
+    backend.save("new", b"", expiry=1000.0)
+    assert backend.purge_expired(now=100.0) == 1
+    assert backend.version("new", now=100.0) is not None
+
+
+@pytest.mark.session_tests
+def test_session_nested_changes_not_cached(backend):
+    client = make_client(backend)
+    client.get("/append/a")  # a new session is saved
+    assert client.get("/append/b").data == b"a,b"
+    # The unsaved change did not leak into the cached copy of the session
+    assert client.get("/append/c").data == b"a,c"
+    assert backend.loads == 0  # all served from the LRU
+
+
+@pytest.mark.session_tests
+def test_session_cookie_expires(backend):
+    client = make_client(backend)
+    # Permanent by default like flask-session, so logins survive closing the browser
+    assert "Expires=" in client.get("/set/a").headers["Set-Cookie"]
+    # The expiry of the cookie is extended even when the session is unchanged
+    assert "Expires=" in client.get("/get").headers["Set-Cookie"]
+    assert backend.saves == 1
+
+    app = Flask(__name__)
+    app.config["SESSION_PERMANENT"] = False
+    interface = CachedSessionInterface.from_config(
+        dict(app.config, SESSION_SQLITE_PATH=backend.path)
+    )
+    assert not interface.new_session().permanent